@@ -1,156 +1,382 @@
 # LLVMgen.py
 from instructionsmodel import *
-_n = 0
-def new_register():
-    global _n
-    ret = f'%.{_n}'
-    _n += 1
-    return ret
+import re
+import struct
 
 def llvm_make(program : Program) -> Program:
-    global _n
-    _n = 0
     new_statements = []
     for s in program.statements:
         match s:
             case FunctionDefinition(name, parameters, body):
-                new_statements.append(FunctionDefinition(name, parameters, llvm_statements(body)))
+                new_statements.append(FunctionDefinition(name, parameters, llvm_function(parameters, body)))
             case GlobalVarDec():
                 new_statements.append(s)
             case _:
                 raise RuntimeError(f'Invalid statement type {s} found during llvm generation')
     return Program(new_statements)
 
-def llvm_statements(statements : list[Statement]) -> list[Statement]:
+# Local variables and parameters never touch the stack: they live in SSA registers, and phi
+# nodes are placed where control flow joins, as in Braun et al., "Simple and Efficient
+# Construction of Static Single Assignment Form". While generating a block, each variable's
+# current value is tracked per block. Reading a variable the block hasn't assigned looks it up
+# in the predecessors:
+#   - one predecessor: its value is used directly
+#   - several predecessors: a phi is placed at the top of the block
+#   - none (unreachable code): 0 (or 0.0), which is also what LOCAL/FLOCAL initialise it to
+# The predecessors of each block are known from the GOTO/CBRANCH instructions that
+# add_control_flow put at the end of each block. A block is "sealed" once all of its
+# predecessors have been generated. Before that (loop headers, while the loop body is still
+# to come) a read creates a phi whose operands are filled in when the block is sealed.
+# Phis whose operands all turn out to be the same value (or itself) are replaced by that value.
+# The function's entry block (added by llvmentry) is the predecessor of the first block, and
+# defines the parameters.
+#
+# Every variable has one LLVM type: double if it's a float (FLOCAL/FLOAD_LOCAL/FSTORE_LOCAL or
+# a float parameter), i32 otherwise, since chars are stored as their int code.
+
+llvm_types = {'int' : 'i32', 'char' : 'i32', 'float' : 'double'}
+zeros = {'i32' : '0', 'double' : '0.0'}
+
+# LLVM names outside [-a-zA-Z$._][-a-zA-Z$._0-9]* must be quoted, with bytes other than
+# printable ASCII written as \XX. User functions are also renamed to wabbit.name, except main,
+# which the runtime starts: LLVM knows what libm functions such as sqrt and fabs compute, and
+# would otherwise fold calls to a Wabbit function of the same name as if it were the builtin.
+plain_name = re.compile(r'[-a-zA-Z$._][-a-zA-Z$._0-9]*')
+
+def llvm_name(name : str) -> str:
+    if plain_name.fullmatch(name):
+        return name
+    escaped = ''.join(chr(b) if 0x20 <= b < 0x7f and b not in b'"\\' else f'\\{b:02X}' for b in name.encode())
+    return f'"{escaped}"'
+
+def function_symbol(name : str) -> str:
+    return '@main' if name == 'main' else '@' + llvm_name(f'wabbit.{name}')
+
+def global_symbol(name : str) -> str:
+    return '@' + llvm_name(name)
+
+def parameter_register(name : str) -> str:
+    return '%' + llvm_name(name)
+
+def llvm_type(wtype : str) -> str:
+    if wtype not in llvm_types:
+        raise RuntimeError(f'Unknown type {wtype} found during LLVM generation')
+    return llvm_types[wtype]
+
+class Phi:
+    def __init__(self, register : str, block : str, var : str, type : str):
+        self.register = register
+        self.block = block
+        self.var = var
+        self.type = type
+        self.operands = [] # (value, predecessor label)
+        self.replaced_by = None
+
+def resolve(value):
+    while isinstance(value, Phi) and value.replaced_by is not None:
+        value = value.replaced_by
+    return value
+
+def value_name(value) -> str:
+    value = resolve(value)
+    return value.register if isinstance(value, Phi) else value
+
+def terminator(block : BLOCK) -> INSTRUCTION | None:
+    # Anything after the first terminator (such as the GOTO following a RETURN) is unreachable
+    for instr in block.instructions:
+        if isinstance(instr, (GOTO, CBRANCH, RETURN, FRETURN)):
+            return instr
+    return None
+
+def successors(block : BLOCK) -> list[str]:
+    match terminator(block):
+        case GOTO(destination):
+            return [destination.label]
+        case CBRANCH(true_block, false_block):
+            return [true_block.label, false_block.label]
+    return []
+
+class SSABuilder:
+    def __init__(self, parameters : Parameters, blocks : list[BLOCK]):
+        self.succs = {block.label : successors(block) for block in blocks}
+        self.preds = {block.label : [] for block in blocks}
+        self.preds[blocks[0].label].append('entry')
+        for block in blocks:
+            for label in self.succs[block.label]:
+                self.preds[label].append(block.label)
+        self.defs = {label : {} for label in self.preds} # block -> variable -> current value
+        self.defs['entry'] = {p.string : parameter_register(p.string) for p in parameters.data}
+        self.types = {p.string : llvm_type(p.wtype) for p in parameters.data} # variable -> LLVM type
+        for block in blocks:
+            for instr in block.instructions:
+                if isinstance(instr, (FLOCAL, FLOAD_LOCAL, FSTORE_LOCAL)):
+                    self.types[instr.name] = 'double'
+        self.filled = {'entry'}
+        self.sealed = set()
+        self.incomplete = {} # unsealed block -> phis waiting for operands
+        self.pending = [] # phis in sealed blocks, whose operands are filled in by finish()
+        self.phis = {label : [] for label in self.preds}
+        self.globals_at_end = {} # generated block -> global name -> value it holds at the end
+        self.count = 0 # registers made, which only need to be unique within the function
+        for label in self.preds:
+            self.try_seal(label)
+
+    def new_register(self) -> str:
+        self.count += 1
+        return f'%.{self.count - 1}'
+
+    def write(self, var : str, block : str, value):
+        self.defs[block][var] = value
+
+    def read(self, var : str, block : str):
+        visited = []
+        while True: # follow single predecessors iteratively, long chains of blocks are common
+            defs = self.defs[block]
+            if var in defs:
+                value = defs[var]
+                break
+            visited.append(block)
+            preds = self.preds[block]
+            if block not in self.sealed:
+                value = self.new_phi(block, var)
+                self.incomplete.setdefault(block, []).append(value)
+                break
+            if len(preds) == 1:
+                block = preds[0]
+                continue
+            if not preds:
+                value = zeros[self.type(var)]
+            else:
+                value = self.new_phi(block, var)
+                self.pending.append(value)
+            break
+        for label in visited:
+            self.defs[label][var] = value
+        return value
+
+    def type(self, var : str) -> str:
+        return self.types.get(var, 'i32')
+
+    def new_phi(self, block : str, var : str) -> Phi:
+        phi = Phi(self.new_register(), block, var, self.type(var))
+        self.phis[block].append(phi)
+        return phi
+
+    def fill(self, block : str):
+        self.filled.add(block)
+        for label in self.succs[block]:
+            self.try_seal(label)
+
+    def try_seal(self, block : str):
+        if block not in self.sealed and all(p in self.filled for p in self.preds[block]):
+            self.sealed.add(block)
+            self.pending += self.incomplete.pop(block, [])
+
+    def finish(self):
+        # Every block is sealed by now, so operands can be read from the end of each predecessor
+        while self.pending:
+            phi = self.pending.pop()
+            phi.operands = [(self.read(phi.var, p), p) for p in self.preds[phi.block]]
+        changed = True
+        while changed:
+            changed = False
+            for phis in self.phis.values():
+                for phi in phis:
+                    if phi.replaced_by is None:
+                        value = trivial_value(phi)
+                        if value is not None:
+                            phi.replaced_by = value
+                            changed = True
+
+    def phi_lines(self, block : str) -> list[str]:
+        lines = []
+        for phi in self.phis[block]:
+            if phi.replaced_by is None:
+                incoming = ', '.join(f'[ {value_name(v)}, %{p} ]' for v, p in phi.operands)
+                lines.append(f'{phi.register} = phi {phi.type} {incoming}')
+        return lines
+
+# The single value a phi always takes, or None if it merges different values
+def trivial_value(phi : Phi):
+    same = None
+    for value, _ in phi.operands:
+        value = resolve(value)
+        if value is phi or value == same:
+            continue
+        if same is not None:
+            return None
+        same = value
+    return zeros[phi.type] if same is None else same
+
+def llvm_function(parameters : Parameters, blocks : list[BLOCK]) -> list[BLOCK]:
+    ssa = SSABuilder(parameters, blocks)
+    generated = []
+    for block in blocks:
+        generated.append(create_llvm(block, ssa))
+        ssa.fill(block.label)
+    ssa.finish()
     out = []
-    for s in statements:
-        out.append(create_llvm(s))
+    for block, ops in zip(blocks, generated):
+        lines = ssa.phi_lines(block.label)
+        for template, operands in ops:
+            lines.append(template.format(*[value_name(v) for v in operands]))
+        out.append(BLOCK(block.label, lines))
     return out
 
-
 # lLvm is a virtual register machine simulator. our code is currently represented in a stack based
 # format, so we must simulate the stack processes to create corresponding register code output
 # operations can only be done using registers.
-# values on the stack are either numbers or register names
+# values on the stack are (value, LLVM type) pairs, where the value is a number or register name
 """
-; Math operations
-
-left + right          %result = add i32 %left, %right
-left - right          %result = sub i32 %left, %right
-left * right          %result = mul i32 %left, %right
-left / right          %result = sdiv i32 %left, %right
-left < right          %result = icmp slt i32 %left, %right
-left <= right         %result = icmp sle i32 %left, %right
-left > right          %result = icmp sgt i32 %left, %right
-left >= right         %result = icmp sge i32 %left, %right
-left == right         %result = icmp eq i32 %left, %right
-left != right         %result = icmp ne i32 %left, %right
-
-; Memory operations
-%{name} = alloca i32                       ; local name;
-{result} = load i32, i32* %{name}          ; result = local[name]
-store i32 {value}, i32* %{name}            ; local[name] = value
-{result} = load i32, i32* @{name}          ; result = global[name]
-store i32 {value}, i32* @{name}            ; global[name] = value
+; Math operations (T is i32, or double for the F instructions)
+
+left + right          %result = add i32 %left, %right          fadd double
+left - right          %result = sub i32 %left, %right          fsub double
+left * right          %result = mul i32 %left, %right          fmul double
+left / right          %result = sdiv i32 %left, %right         fdiv double
+left << right         %result = shl i32 %left, %right
+-value                %result = sub i32 0, %value              fneg double %value
+left < right          %result = icmp slt i32 %left, %right     fcmp olt double
+left <= right         %result = icmp sle i32 %left, %right     fcmp ole double
+left > right          %result = icmp sgt i32 %left, %right     fcmp ogt double
+left >= right         %result = icmp sge i32 %left, %right     fcmp oge double
+left == right         %result = icmp eq i32 %left, %right      fcmp oeq double
+left != right         %result = icmp ne i32 %left, %right      fcmp une double
+
+; Relations give an i1. It is widened to i32 (zext) when used as a number, and a number used
+; as a branch condition is compared with 0, as the VM treats any non-zero value as true.
+
+; Memory operations (globals only, locals are SSA values)
+{result} = load T, T* @{name}              ; result = global[name]
+store T {value}, T* @{name}                ; global[name] = value
+{result} = phi T [ {a}, %{La} ], ...       ; value of a local where control flow joins
 
 ; Control flow operations
 br label %{name}                           ; GOTO(name)
 br i1 {test}, label %{Lc}, label %{La}     ; CBRANCH(Lc, La)
-{result} = call i32 (i32) @name(i32 {arg}) ; result = name(arg)
-ret i32 {value}                            ; return value
+{result} = call T @name(T {arg}, ...)      ; result = name(arg, ...)
+ret T {value}                              ; return value
 
 ; Printing
-call i32 (i32) @_print_int(i32 {value})    ; print value
+call i32 @_print_int(i32 {value})          ; print value
+call i32 @_print_float(double {value})     ; print value, for floats
+call i32 @_print_char(i32 {value})         ; print value, for chars
 """
-def create_llvm(block : BLOCK) -> BLOCK:
-    ops = [] # everything is converted to a string, all LLVM ops must be strings
+binary_ops = {
+    ADD : 'add i32', MINUS : 'sub i32', MULT : 'mul i32', DIVIDE : 'sdiv i32', SHL : 'shl i32',
+    FADD : 'fadd double', FMINUS : 'fsub double', FMULT : 'fmul double', FDIVIDE : 'fdiv double',
+    LT : 'icmp slt i32', LE : 'icmp sle i32', GT : 'icmp sgt i32',
+    GE : 'icmp sge i32', EQ : 'icmp eq i32', NE : 'icmp ne i32',
+    # Ordered comparisons are false if either side is NaN, and une is true, as in Python
+    FLT : 'fcmp olt double', FLE : 'fcmp ole double', FGT : 'fcmp ogt double',
+    FGE : 'fcmp oge double', FEQ : 'fcmp oeq double', FNE : 'fcmp une double',
+}
+
+def float_constant(value : float) -> str:
+    # The exact bits in hex, as LLVM only accepts decimal constants it can represent exactly
+    return f'0x{struct.unpack("<Q", struct.pack("<d", value))[0]:016X}'
+
+# Each op is generated as (format string, operands), since an operand may be a phi that is only
+# resolved once the whole function has been generated
+def create_llvm(block : BLOCK, ssa : SSABuilder) -> list[tuple[str, list]]:
+    ops = []
     stack = [] # vm simulation, which we use to generate appropriate LLVM instructions
+    label = block.label
+
+    # Pops a value, converting relation results and branch conditions to the type needed
+    def pop(wanted : str):
+        value, found = stack.pop()
+        if found == wanted:
+            return value
+        result = ssa.new_register()
+        if found == 'i1' and wanted == 'i32':
+            ops.append((f'{result} = zext i1 {{}} to i32', [value]))
+        elif found == 'i32' and wanted == 'i1':
+            ops.append((f'{result} = icmp ne i32 {{}}, 0', [value]))
+        elif found == 'double' and wanted == 'i1':
+            ops.append((f'{result} = fcmp une double {{}}, 0.0', [value]))
+        else:
+            raise RuntimeError(f'Expected {wanted} but found {found} during LLVM generation')
+        return result
+
+    # Global name -> the value it currently holds, so that a global is only loaded again after
+    # something may have changed it. Stores forward the stored value, and calls forget everything
+    # since the callee may assign any global. A block with a single predecessor that has already
+    # been generated starts from where that block ended, as the predecessor's registers are
+    # available in it.
+    preds = ssa.preds[label]
+    known = dict(ssa.globals_at_end.get(preds[0], {})) if len(preds) == 1 else {}
     for instr in block.instructions:
         match instr:
             case PUSH(value):
-                stack.append(str(instr.value))
+                stack.append((str(value), 'i32'))
+            case FPUSH(value):
+                stack.append((float_constant(value), 'double'))
             case POP():
                 stack.pop()
             case ARITHMETIC() | RELATION():
-                right = stack.pop()
-                left = stack.pop()
-                result = new_register()
-                stack.append(result)
-                op_str = ""
-                if isinstance(instr, ARITHMETIC):
-                    match instr:
-                        case ADD():
-                            op_str = 'add'
-                        case MINUS():
-                            op_str = 'sub'
-                        case MULT():
-                            op_str = 'mul'
-                        case DIVIDE():
-                            op_str = 'sdiv'
-                    ops.append(LLVM(f'{result} = {op_str} i32 {left}, {right}'))
-                elif isinstance(instr, RELATION):
-                    match instr:
-                        case LT():
-                            op_str = 'slt'
-                        case LE():
-                            op_str = 'sle'
-                        case GT():
-                            op_str = 'sgt'
-                        case GE():
-                            op_str = 'sge'
-                        case EQ():
-                            op_str = 'eq'
-                        case NE():
-                            op_str = 'ne'
-                    ops.append(LLVM(f'{result} = icmp {op_str} i32 {left}, {right}'))
-            case LOAD_GLOBAL(name):
-                register = new_register()
-                ops.append(LLVM(f'{register} = load i32, i32* @{name}'))
-                stack.append(register)
-            case LOAD_LOCAL(name):
-                register = new_register()
-                ops.append(LLVM(f'{register} = load i32, i32* %{name}'))
-                stack.append(register)
-            case STORE_GLOBAL(name):
-                value = stack.pop()
-                ops.append(LLVM(f'store i32 {value}, i32* @{name}'))
-            case STORE_LOCAL(name):
-                value = stack.pop()
-                ops.append(LLVM(f'store i32 {value}, i32* %{name}'))
+                template = binary_ops[type(instr)]
+                operand_type = template.split()[-1]
+                right = pop(operand_type)
+                left = pop(operand_type)
+                result = ssa.new_register()
+                ops.append((f'{result} = {template} {{}}, {{}}', [left, right]))
+                stack.append((result, 'i1' if isinstance(instr, RELATION) else operand_type))
+            case NEG():
+                result = ssa.new_register()
+                ops.append((f'{result} = sub i32 0, {{}}', [pop('i32')]))
+                stack.append((result, 'i32'))
+            case FNEG():
+                result = ssa.new_register()
+                ops.append((f'{result} = fneg double {{}}', [pop('double')]))
+                stack.append((result, 'double'))
+            case LOAD_GLOBAL(name) | FLOAD_GLOBAL(name):
+                type_ = 'double' if isinstance(instr, FLOAD_GLOBAL) else 'i32'
+                if name not in known:
+                    known[name] = ssa.new_register()
+                    ops.append((f'{known[name]} = load {type_}, {type_}* {global_symbol(name)}', []))
+                stack.append((known[name], type_))
+            case LOAD_LOCAL(name) | FLOAD_LOCAL(name):
+                stack.append((ssa.read(name, label), ssa.type(name)))
+            case STORE_GLOBAL(name) | FSTORE_GLOBAL(name):
+                type_ = 'double' if isinstance(instr, FSTORE_GLOBAL) else 'i32'
+                known[name] = pop(type_)
+                ops.append((f'store {type_} {{}}, {type_}* {global_symbol(name)}', [known[name]]))
+            case STORE_LOCAL(name) | FSTORE_LOCAL(name):
+                ssa.write(name, label, pop(ssa.type(name)))
             case PRINT():
-                value = stack.pop()
-                ops.append(LLVM(f'call i32 (i32) @_print_int(i32 {value})'))
-            case LOCAL(name):
-                ops.append(LLVM(f'%{name} = alloca i32'))
-            case RETURN():
-                value = stack.pop()
-                ops.append(LLVM(f'ret i32 {value}'))
+                ops.append(('call i32 @_print_int(i32 {})', [pop('i32')]))
+            case FPRINT():
+                ops.append(('call i32 @_print_float(double {})', [pop('double')]))
+            case CPRINT():
+                ops.append(('call i32 @_print_char(i32 {})', [pop('i32')]))
+            case LOCAL(name) | FLOCAL(name):
+                ssa.write(name, label, zeros[ssa.type(name)])
+            case RETURN() | FRETURN():
+                type_ = 'double' if isinstance(instr, FRETURN) else 'i32'
+                value = pop(type_)
+                if ops and ops[-1][0].startswith(f'{value} = call '):
+                    # Returning a call's result directly: nothing of this frame is needed after it
+                    template, args = ops[-1]
+                    ops[-1] = (template.replace(' = call ', ' = tail call ', 1), args)
+                ops.append((f'ret {type_} {{}}', [value]))
+                break
             case GOTO(destination):
-                ops.append(LLVM(f'br label %{destination.label}'))
+                ops.append((f'br label %{destination.label}', []))
+                break
             case CBRANCH(true_block, false_block):
-                test = stack.pop()
-                ops.append(LLVM(f'br i1 {test}, label %{true_block.label}, label%{false_block.label}'))
+                ops.append((f'br i1 {{}}, label %{true_block.label}, label %{false_block.label}', [pop('i1')]))
+                break
             case CALL(name, return_type, arg_wtypes):
-                register = new_register()
-                arg_types = []
-                for t in arg_wtypes:
-                    if t == 'int':
-                        arg_types.append('i32')
-                    elif t == 'float':
-                        arg_types.append('f32')
-                    else:
-                        raise RuntimeError(f'Unknown type in {arg_wtypes}')
-                # TODO: CALL has been changed
-                # Update the LLVM generation with thew new attributes of CALL
-                llvm_return = "" # TODO: update
-                ins = f'{register} = call i32 ({",".join(arg_types)}) @{name}('
-                args = []
-                for _ in range(num_args):
-                    args.append(f'i32 {stack.pop()}')
-                args.reverse()
-                ins += ", ".join(args) + ")"
-                ops.append(LLVM(ins))
-                stack.append(register)
+                arg_types = [llvm_type(t) for t in arg_wtypes]
+                args = [pop(t) for t in reversed(arg_types)][::-1]
+                result_type = llvm_type(return_type)
+                register = ssa.new_register()
+                placeholders = ', '.join(f'{t} {{}}' for t in arg_types)
+                ops.append((f'{register} = call {result_type} {function_symbol(name)}({placeholders})', args))
+                stack.append((register, result_type))
+                known.clear()
             case _:
                 raise RuntimeError(f'Unknown instruction type {instr} found during LLVM generation')
-    return BLOCK(block.label, ops)
+    ssa.globals_at_end[label] = known
+    return ops
@@ -1,6 +1,14 @@
 from model import *
+from passes import Pass, run_passes
+
 def add_return(program : Program) -> Program:
-    return Program([add_fn_return(s) for s in program.statements])
+    return run_passes(program, [AddReturn()])
+
+class AddReturn(Pass):
+    def exit_block(self, owner : ASTNode, statements : list[Statement]) -> list[Statement]:
+        if not isinstance(owner, Program):
+            return statements
+        return [add_fn_return(s) for s in statements]
 
 def add_fn_return(statement : Statement) -> Statement:
     if isinstance(statement, FunctionDefinition):
@@ -8,5 +16,6 @@ def add_fn_return(statement : Statement) -> Statement:
         parameters = statement.parameters
         body = statement.body
         if body == [] or not isinstance(body[-1], Return):
-            statement = FunctionDefinition(name, parameters, body + [Return(Integer(0))])
-    return statement
\ No newline at end of file
+            zero = Float(0.0) if name.wtype == 'float' else Integer(0)
+            statement = FunctionDefinition(name, parameters, body + [Return(zero)])
+    return statement
@@ -0,0 +1,70 @@
+# backend.py
+
+from model import *
+from main import front_end, function_to_llvm
+from inline import Inliner
+from passmanager import default_level
+from instrument import Instrumentation
+from llvmformat import header, format_global
+from cache import FunctionCache, dependency_types
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, TextIO
+import io
+
+# Builds the LLVM module one function at a time. After front_end the functions are independent,
+# and labels/registers are numbered per function, so each function can be compiled on its own:
+# looked up in a FunctionCache, or sent to a pool of worker processes. Each function's IR is
+# written out as soon as it is ready and then dropped, always in program order, so the output
+# is byte-identical to llvm_format(compile(program)) whatever the cache contents and number
+# of jobs, and memory use doesn't grow with the number of functions.
+# With an Instrumentation, the functions are compiled in this process, so that it sees them all.
+def emit_module(program : Program, out : TextIO, cache : FunctionCache | None = None, jobs : int = 1,
+                inliner : Inliner | None = None, level : int = default_level,
+                instrumentation : Instrumentation | None = None):
+    program = front_end(program, inliner, level = level, instrumentation = instrumentation)
+    functions = [s for s in program.statements if isinstance(s, FunctionDefinition)]
+    keys = []
+    cached = [False] * len(functions)
+    if cache is not None:
+        signatures, global_types = dependency_types(program)
+        for i, function in enumerate(functions):
+            keys.append(cache.key(function, signatures, global_types, level))
+            cached[i] = cache.contains(keys[i])
+    compiled = compile_functions([f for f, hit in zip(functions, cached) if not hit], jobs, level, instrumentation)
+
+    out.write(header)
+    i = 0
+    for s in program.statements:
+        match s:
+            case FunctionDefinition():
+                text = cache.get(keys[i]) if cached[i] else None
+                if text is None:
+                    text = function_to_llvm(s, level, instrumentation) if cached[i] else next(compiled)
+                    if cache is not None:
+                        cache.put(keys[i], text)
+                out.write('\n')
+                out.write(text)
+                i += 1
+            case GlobalVarDec():
+                out.write('\n')
+                out.write(format_global(s))
+
+def compile_module(program : Program, cache : FunctionCache | None = None, jobs : int = 1,
+                   inliner : Inliner | None = None, level : int = default_level,
+                   instrumentation : Instrumentation | None = None) -> str:
+    out = io.StringIO()
+    emit_module(program, out, cache, jobs, inliner, level, instrumentation)
+    return out.getvalue()
+
+# Yields the IR of each function, in order, as it becomes available
+def compile_functions(functions : list[FunctionDefinition], jobs : int, level : int = default_level,
+                      instrumentation : Instrumentation | None = None) -> Iterator[str]:
+    if jobs <= 1 or len(functions) <= 1 or instrumentation is not None:
+        for f in functions:
+            yield function_to_llvm(f, level, instrumentation)
+        return
+    # Several functions per task, so that pickling overhead doesn't dominate small functions
+    chunksize = max(1, len(functions) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        yield from pool.map(partial(function_to_llvm, level = level), functions, chunksize = chunksize)
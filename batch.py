@@ -0,0 +1,146 @@
+# batch.py
+
+from main import file_to_AST
+from cache import FunctionCache
+from backend import emit_module
+from driver import Toolchain, ClangNotFound
+from passmanager import levels, default_level
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Compiles many programs at once. Each program is parsed and lowered to IR on a process pool,
+# and as soon as its IR is ready it joins a queue of clang invocations, of which at most
+# clang_jobs run at a time as asyncio subprocesses. Every file gets a result record:
+#   file, status ('ok' or 'error'), stage that failed, error message,
+#   compile_seconds (parsing through IR), clang_seconds, output path and output_bytes
+
+def collect_sources(inputs : list[str]) -> list[str]:
+    sources = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '**', '*.wb'), recursive = True)
+        else:
+            matches = glob.glob(pattern, recursive = True)
+        if not matches:
+            raise FileNotFoundError(f'No .wb files match {pattern}')
+        sources += sorted(matches)
+    return list(dict.fromkeys(sources))
+
+def output_paths(sources : list[str], out_dir : str, suffix : str) -> list[str]:
+    # Mirror the layout of the sources below their common directory, so equal names can't collide
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(s)) for s in sources])
+    return [os.path.join(out_dir, os.path.splitext(os.path.relpath(os.path.abspath(s), root))[0] + suffix)
+            for s in sources]
+
+# Runs in a worker process
+def lower_to_file(source : str, ir_path : str, cache_dir : str | None, level : int) -> dict:
+    start = time.perf_counter()
+    try:
+        program = file_to_AST(source)
+        cache = FunctionCache(cache_dir) if cache_dir else None
+        os.makedirs(os.path.dirname(ir_path), exist_ok = True)
+        with open(ir_path, 'w', buffering = 1 << 16) as file:
+            emit_module(program, file, cache, level = level)
+    except Exception as e: # a broken program shouldn't stop the rest of the batch
+        return {'status' : 'error', 'stage' : 'compile', 'error' : f'{type(e).__name__}: {e}',
+                'compile_seconds' : time.perf_counter() - start}
+    return {'status' : 'ok', 'compile_seconds' : time.perf_counter() - start}
+
+async def build_one(source : str, output : str, ir_path : str, pool : ProcessPoolExecutor,
+                    clang_slots : asyncio.Semaphore, toolchain : Toolchain | None,
+                    runtime : str | None, cache_dir : str | None, level : int) -> dict:
+    loop = asyncio.get_running_loop()
+    result = {'file' : source}
+    result.update(await loop.run_in_executor(pool, lower_to_file, source, ir_path, cache_dir, level))
+    if result['status'] == 'ok' and toolchain is not None:
+        async with clang_slots:
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(output), exist_ok = True)
+            temp_output = f'{output}.{os.getpid()}.tmp'
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    toolchain.clang, *toolchain.link_args(ir_path, runtime, temp_output),
+                    stderr = asyncio.subprocess.PIPE)
+            except FileNotFoundError:
+                result.update(status = 'error', stage = 'clang', error = str(ClangNotFound(toolchain.clang)))
+                return result
+            _, errors = await process.communicate()
+            result['clang_seconds'] = time.perf_counter() - start
+        if process.returncode != 0:
+            result.update(status = 'error', stage = 'clang', error = errors.decode(errors = 'replace'))
+        else:
+            os.replace(temp_output, output)
+    if result['status'] == 'ok':
+        result['output'] = output
+        result['output_bytes'] = os.path.getsize(output)
+    return result
+
+async def run_builds(sources, outputs, ir_paths, jobs, clang_jobs, toolchain, runtime, cache_dir, level) -> list[dict]:
+    clang_slots = asyncio.Semaphore(clang_jobs)
+    with ProcessPoolExecutor(max_workers = jobs) as pool:
+        return await asyncio.gather(*[build_one(source, output, ir_path, pool, clang_slots,
+                                                toolchain, runtime, cache_dir, level)
+                                      for source, output, ir_path in zip(sources, outputs, ir_paths)])
+
+# With toolchain = None only the IR is produced, as <out_dir>/<name>.ll. Our own passes are
+# chosen by level, and clang's by the toolchain.
+def run_batch(sources : list[str], out_dir : str, toolchain : Toolchain | None = None,
+              jobs : int = 1, clang_jobs : int = 1, cache_dir : str | None = None,
+              level : int = default_level) -> list[dict]:
+    if not sources:
+        return []
+    if toolchain is None:
+        outputs = output_paths(sources, out_dir, '.ll')
+        return asyncio.run(run_builds(sources, outputs, outputs, jobs, clang_jobs, None, None, cache_dir, level))
+    runtime = toolchain.runtime_object()
+    outputs = output_paths(sources, out_dir, '')
+    os.makedirs(out_dir, exist_ok = True)
+    with tempfile.TemporaryDirectory(prefix = '.wabbit-batch-', dir = out_dir) as ir_dir:
+        ir_paths = output_paths(sources, ir_dir, '.ll')
+        return asyncio.run(run_builds(sources, outputs, ir_paths, jobs, clang_jobs, toolchain, runtime, cache_dir, level))
+
+def summarize(results : list[dict], seconds : float) -> dict:
+    failed = sum(1 for r in results if r['status'] != 'ok')
+    return {'total' : len(results), 'ok' : len(results) - failed, 'failed' : failed,
+            'seconds' : seconds, 'files' : results}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description = 'Compile every .wb program in directories or globs')
+    arg_parser.add_argument('inputs', nargs = '+', help = 'directories, files or glob patterns')
+    arg_parser.add_argument('--out-dir', '-o', default = 'build', help = 'where the executables go')
+    arg_parser.add_argument('--jobs', '-j', type = int, default = os.cpu_count() or 1,
+                            help = 'processes for parsing and lowering')
+    arg_parser.add_argument('--clang-jobs', type = int, default = os.cpu_count() or 1,
+                            help = 'clang invocations to run at once')
+    arg_parser.add_argument('--summary', metavar = 'FILE', help = 'write the JSON summary here instead of stdout')
+    arg_parser.add_argument('--cache', metavar = 'DIR', help = 'per-function LLVM cache directory')
+    arg_parser.add_argument('-O', dest = 'opt_level', type = int, choices = levels, default = default_level,
+                            help = f'optimization level, for both our own passes and clang (default {default_level})')
+    arg_parser.add_argument('--target', metavar = 'TRIPLE', help = 'target triple passed to clang')
+    arg_parser.add_argument('--clang', default = 'clang', help = 'clang executable to use')
+    arg_parser.add_argument('--emit-llvm', action = 'store_true', help = 'only write the LLVM IR of each program')
+    args = arg_parser.parse_args()
+    toolchain = None if args.emit_llvm else Toolchain(args.clang, args.opt_level, args.target)
+    start = time.perf_counter()
+    try:
+        results = run_batch(collect_sources(args.inputs), args.out_dir, toolchain,
+                            args.jobs, args.clang_jobs, args.cache, args.opt_level)
+    except ClangNotFound as e:
+        sys.exit(str(e))
+    summary = json.dumps(summarize(results, time.perf_counter() - start), indent = 2)
+    if args.summary:
+        with open(args.summary, 'w') as file:
+            file.write(summary + '\n')
+    else:
+        print(summary)
+    sys.exit(1 if any(r['status'] != 'ok' for r in results) else 0)
+
+if __name__ == '__main__':
+    main()
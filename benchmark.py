@@ -0,0 +1,228 @@
+# benchmark.py
+
+from model import *
+from tokenizer import tokenize
+from parser import Parser
+from main import front_end, back_end_passes, llvm_passes
+from passmanager import PassManager, default_level
+from llvmformat import llvm_format
+import argparse
+import gc
+import json
+import math
+import random
+import sys
+import time
+
+# Measures how the compile time of each stage grows with the size of the program.
+# generate_program writes a synthetic program with a given number of statements, spread over
+# a number of functions (by default one per 100 statements, so functions stay a realistic
+# size), with if/while nested up to depth, expressions of expression_length operands, and some
+# globals that everything reads and writes. Each size is compiled, timing every stage from
+# tokenize to llvm_format, and each stage's times are fitted to t = c * n^k by least squares on
+# log t and log n. k is about 1 for a stage that scales linearly, and 2 for a quadratic one.
+#
+# A baseline (written with --save-baseline) keeps the settings, times and fits of a run. With
+# --baseline, the run fails when a stage's k is more than --exponent-tolerance above the
+# baseline's, or when it is more than --time-tolerance times slower at any size. The exponent
+# doesn't depend much on the machine, which is what catches quadratic behaviour; the time check
+# is only meaningful against a baseline from the same machine.
+
+stages = ['tokenize', 'parse', 'front end', 'back end', 'llvm', 'llvm_format']
+noise_seconds = 0.01 # times below this are too noisy to compare with the baseline
+
+def generate_program(statements : int, functions : int | None = None, depth : int = 3,
+                     expression_length : int = 6, globals_count : int = 10, seed : int = 0) -> str:
+    rng = random.Random(seed)
+    if functions is None:
+        functions = statements // 100 + 1
+    lines = []
+    count = 0 # statements written so far
+    global_names = [f'g{i}' for i in range(globals_count)]
+    for name in global_names:
+        lines.append(f'var {name} = {rng.randint(0, 9)};')
+        count += 1
+    counter = 0 # for unique local names
+
+    def expression(names : list[str], length : int = expression_length) -> str:
+        parts = [rng.choice(names) if rng.random() < 0.7 else str(rng.randint(1, 9))]
+        for _ in range(length - 1):
+            operand = rng.choice(names) if rng.random() < 0.7 else str(rng.randint(1, 9))
+            parts.append(rng.choice(['+', '-', '*', '+', '-', '/ 3 +']))
+            parts.append(operand)
+        if length > 2 and rng.random() < 0.3: # some grouping
+            parts[0] = '(' + parts[0]
+            parts[2] += ')'
+        return ' '.join(parts)
+
+    def condition(names : list[str]) -> str:
+        test = f'{expression(names, max(1, expression_length // 2))} < {rng.choice(names)}'
+        if rng.random() < 0.2:
+            test += f' and {rng.choice(names)} != 0'
+        return test
+
+    # Statements for one block, until budget statements have been written
+    def block(budget : int, level : int, names : list[str], callable : list[str], indent : int) -> int:
+        nonlocal counter
+        names = list(names)
+        pad = '    ' * indent
+        used = 0
+        while used < budget:
+            choice = rng.random()
+            if choice < 0.1 and level < depth and budget - used > 3:
+                lines.append(f'{pad}if {condition(names)} {{')
+                inner = rng.randint(1, max(1, (budget - used) // 3))
+                used += 1 + block(inner, level + 1, names, callable, indent + 1)
+                lines.append(f'{pad}}} else {{')
+                used += block(1, level + 1, names, callable, indent + 1)
+                lines.append(f'{pad}}}')
+            elif choice < 0.15 and level < depth and budget - used > 4:
+                counter += 1
+                loop = f'i{counter}'
+                lines.append(f'{pad}var {loop} = 0;')
+                lines.append(f'{pad}while {loop} < {rng.randint(2, 10)} {{')
+                lines.append(f'{pad}    {loop} = {loop} + 1;')
+                inner = rng.randint(1, max(1, (budget - used) // 3))
+                used += 3 + block(inner, level + 1, names + [loop], callable, indent + 1)
+                lines.append(f'{pad}}}')
+            elif choice < 0.35:
+                counter += 1
+                lines.append(f'{pad}var x{counter} = {expression(names)};')
+                names.append(f'x{counter}')
+                used += 1
+            elif choice < 0.45 and callable:
+                target = rng.choice(names)
+                lines.append(f'{pad}{target} = {rng.choice(callable)}({expression(names, 2)}, {rng.choice(names)});')
+                used += 1
+            elif choice < 0.9:
+                lines.append(f'{pad}{rng.choice(names)} = {expression(names)};')
+                used += 1
+            else:
+                lines.append(f'{pad}print {expression(names)};')
+                used += 1
+        return used
+
+    share = max(1, (statements - count) // (functions + 1))
+    function_names = []
+    for i in range(functions):
+        name = f'f{i}'
+        lines.append(f'func {name}(a int, b int) int {{')
+        count += block(share - 1, 0, global_names + ['a', 'b'], function_names[-5:], 1)
+        lines.append(f'    return {expression(global_names + ["a", "b"])};')
+        lines.append('}')
+        count += 1
+        function_names.append(name)
+    block(max(1, statements - count), 0, global_names, function_names[-5:], 0)
+    return '\n'.join(lines) + '\n'
+
+# Seconds taken by each stage to compile source, at an optimization level
+def time_stages(source : str, level : int = default_level) -> dict[str, float]:
+    times = {}
+    def stage(name, fn, *args):
+        gc.collect() # so that garbage from the last stage isn't collected during this one
+        start = time.perf_counter()
+        result = fn(*args)
+        times[name] = time.perf_counter() - start
+        return result
+    tokens = stage('tokenize', tokenize, source)
+    program = stage('parse', lambda: Program(Parser(tokens).parse_statements()))
+    program = stage('front end', lambda: front_end(program, level = level))
+    program = stage('back end', PassManager(back_end_passes(), level).run, program)
+    program = stage('llvm', PassManager(llvm_passes(), level).run, program)
+    stage('llvm_format', llvm_format, program)
+    return times
+
+# Least squares fit of log t = log c + k log n, returns (c, k)
+def fit_power_law(sizes : list[int], seconds : list[float]) -> tuple[float, float]:
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in seconds]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    k = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance if variance else 0.0
+    return math.exp(mean_y - k * mean_x), k
+
+def run_benchmark(sizes : list[int], settings : dict, level : int) -> dict:
+    seconds = {stage : [] for stage in stages}
+    for n in sizes:
+        source = generate_program(n, **settings)
+        # Small sizes take the best of several runs, so that their times aren't just noise
+        runs = [time_stages(source, level) for _ in range(max(1, min(5, 10 ** 4 // n)))]
+        for stage in stages:
+            seconds[stage].append(min(run[stage] for run in runs))
+        print(f'{n:>9} statements: ' + ', '.join(f'{stage} {seconds[stage][-1]:.3f}s' for stage in stages),
+              file = sys.stderr)
+    results = {'sizes' : sizes, 'settings' : settings, 'level' : level, 'stages' : {}}
+    for stage in stages:
+        c, k = fit_power_law(sizes, seconds[stage]) if len(sizes) > 1 else (seconds[stage][0], 1.0)
+        results['stages'][stage] = {'seconds' : seconds[stage], 'coefficient' : c, 'exponent' : k}
+    return results
+
+# Why results regressed from baseline, or [] if they didn't
+def compare(results : dict, baseline : dict, exponent_tolerance : float, time_tolerance : float) -> list[str]:
+    if baseline['settings'] != results['settings'] or baseline['level'] != results['level']:
+        raise RuntimeError('The baseline was measured with other generator settings or optimization level')
+    problems = []
+    for stage, base in baseline['stages'].items():
+        current = results['stages'].get(stage)
+        if current is None:
+            problems.append(f'{stage}: not measured')
+            continue
+        if current['exponent'] > base['exponent'] + exponent_tolerance:
+            problems.append(f'{stage}: grows as n^{current["exponent"]:.2f}, '
+                            f'the baseline as n^{base["exponent"]:.2f}')
+        base_times = dict(zip(baseline['sizes'], base['seconds']))
+        for n, t in zip(results['sizes'], current['seconds']):
+            if n in base_times and t > max(base_times[n], noise_seconds) * time_tolerance:
+                problems.append(f'{stage}: {t:.3f}s for {n} statements, the baseline took {base_times[n]:.3f}s')
+    return problems
+
+def format_results(results : dict) -> str:
+    sizes = results['sizes']
+    lines = [f'{"stage":<12}' + ''.join(f'{n:>11}' for n in sizes) + '   fit']
+    for stage, result in results['stages'].items():
+        times = ''.join(f'{t:>10.3f}s' for t in result['seconds'])
+        lines.append(f'{stage:<12}{times}   {result["coefficient"]:.2e} * n^{result["exponent"]:.2f}')
+    return '\n'.join(lines)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description = 'Time each compiler stage on synthetic programs of growing size')
+    arg_parser.add_argument('--sizes', type = lambda s: [int(n) for n in s.split(',')],
+                            default = [10 ** e for e in range(2, 6)],
+                            help = 'comma-separated statement counts (default 100,1000,10000,100000)')
+    arg_parser.add_argument('--functions', type = int, help = 'functions per program (default one per 100 statements)')
+    arg_parser.add_argument('--depth', type = int, default = 3, help = 'deepest nesting of if/while')
+    arg_parser.add_argument('--expression-length', type = int, default = 6, help = 'operands per expression')
+    arg_parser.add_argument('--globals', type = int, default = 10, help = 'number of globals')
+    arg_parser.add_argument('--seed', type = int, default = 0)
+    arg_parser.add_argument('-O', dest = 'opt_level', type = int, choices = [0, 1, 2, 3], default = default_level,
+                            help = 'optimization level')
+    arg_parser.add_argument('--baseline', metavar = 'FILE', help = 'fail if slower than the baseline in FILE')
+    arg_parser.add_argument('--save-baseline', metavar = 'FILE', help = 'write the results to FILE as a baseline')
+    arg_parser.add_argument('--exponent-tolerance', type = float, default = 0.2,
+                            help = 'how much a stage\'s exponent may grow over the baseline')
+    arg_parser.add_argument('--time-tolerance', type = float, default = 2.0,
+                            help = 'how many times slower than the baseline a stage may be')
+    args = arg_parser.parse_args()
+    settings = {'functions' : args.functions, 'depth' : args.depth, 'expression_length' : args.expression_length,
+                'globals_count' : args.globals, 'seed' : args.seed}
+    results = run_benchmark(args.sizes, settings, args.opt_level)
+    print(format_results(results))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            file.write(json.dumps(results, indent = 2) + '\n')
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        try:
+            problems = compare(results, baseline, args.exponent_tolerance, args.time_tolerance)
+        except RuntimeError as e:
+            sys.exit(str(e))
+        for problem in problems:
+            print(f'Regression: {problem}')
+        if problems:
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+if __name__ == '__main__':
+    main()
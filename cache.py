@@ -0,0 +1,89 @@
+# cache.py
+
+from model import *
+from main import iter_nodes
+import main, passmanager, createinstructions, createblocks, controlflow, simplifycfg, valuenumbering, LLVMgen, llvmentry, llvmformat, instructionsmodel
+import hashlib
+import os
+
+# Persistent per-function cache of generated LLVM.
+# After front_end every function is self-contained except for the functions it calls and the
+# globals it uses, so a function's LLVM only depends on:
+#   1. its resolved AST (identifiers already carry their resolved types)
+#   2. the signatures of the functions it calls, and the types of the globals it uses
+#   3. the backend itself, so editing the compiler invalidates every entry. main and passmanager
+#      are included, as they decide which backend passes run at each level
+#   4. the optimization level, which chooses the backend passes
+# Entries are stored as <key>.ll files, one per function body.
+
+def backend_version() -> str:
+    digest = hashlib.sha256()
+    for module in [main, passmanager, instructionsmodel, createinstructions, createblocks, controlflow, simplifycfg, valuenumbering, LLVMgen, llvmentry, llvmformat]:
+        with open(module.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+class FunctionCache:
+    def __init__(self, directory : str):
+        self.directory = directory
+        self.version = backend_version()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok = True)
+
+    def key(self, function : FunctionDefinition, signatures : dict, global_types : dict, level : int) -> str:
+        called = set()
+        used_globals = set()
+        for node in iter_nodes(function):
+            match node:
+                case FunctionCall(name):
+                    called.add(name.string)
+                case GlobalId(string):
+                    used_globals.add(string)
+        dependencies = ([(name, signatures.get(name)) for name in sorted(called)],
+                        [(name, global_types.get(name)) for name in sorted(used_globals)])
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(repr(function).encode())
+        digest.update(repr(dependencies).encode())
+        digest.update(f'-O{level}'.encode())
+        return digest.hexdigest()
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.directory, f'{key}.ll')
+
+    def contains(self, key : str) -> bool: # Counts towards the hit/miss report
+        if os.path.exists(self.path(key)):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def get(self, key : str) -> str | None:
+        try:
+            with open(self.path(key), 'r') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key : str, text : str):
+        # Write then rename, so that concurrent builds never see a partial entry
+        path = self.path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+
+    def report(self) -> str:
+        return f'Function cache: {self.hits} hits, {self.misses} misses'
+
+# Function name -> (return type, parameter types) and global name -> type, for building keys
+def dependency_types(program : Program) -> tuple[dict, dict]:
+    signatures = {}
+    global_types = {}
+    for s in program.statements:
+        match s:
+            case FunctionDefinition(name, parameters):
+                signatures[name.string] = (name.wtype, [p.wtype for p in parameters.data])
+            case GlobalVarDec(name):
+                global_types[name.string] = name.wtype
+    return signatures, global_types
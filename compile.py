@@ -1,34 +1,73 @@
 # compile.py
 
 from model import *
-from tokenizer import tokenize
+from tokenizer import iter_file_tokens
 from parser import Parser
-from main import compile
-from llvmformat import llvm_format
-from formatter import format_program
+from cache import FunctionCache
+from backend import emit_module
+from driver import Toolchain, ClangNotFound
+from inline import Inliner, default_threshold
+from instrument import Instrumentation
+from passmanager import levels, default_level
+import argparse
 import sys
-import os
 
 def file_to_AST(filename : str) -> Program:
-    with open(filename, 'r') as file:
-        src = file.read()
-    tokens = tokenize(src)
-    program = Program(Parser(tokens).parse_statements())
-    return program
+    return Program(Parser(iter_file_tokens(filename)).parse_statements())
 
 def main():
-    filename = sys.argv[1]
-    output = sys.argv[2]
-    syntax_tree = file_to_AST(f'tests/{filename}')
-    simplified_tree = compile(syntax_tree)
-    #print(format_program(simplified_tree))
-    out = llvm_format(simplified_tree)
-    print(out)
-    with open("temp.ll", 'w') as file:
-        file.write(out)
-    print(f"Created llvm output file")
-    os.system(f'clang temp.ll runtime.c -o {output}')
+    arg_parser = argparse.ArgumentParser(description = 'Compile a .wb program from tests/ with clang')
+    arg_parser.add_argument('filename')
+    arg_parser.add_argument('output')
+    arg_parser.add_argument('--cache', metavar = 'DIR',
+                            help = 'reuse the LLVM of unchanged functions, cached in DIR')
+    arg_parser.add_argument('--jobs', '-j', metavar = 'N', type = int, default = 1,
+                            help = 'run the backend on N processes')
+    arg_parser.add_argument('-O', dest = 'opt_level', type = int, choices = levels, default = default_level,
+                            help = f'optimization level, for both our own passes and clang (default {default_level})')
+    arg_parser.add_argument('--target', metavar = 'TRIPLE', help = 'target triple passed to clang')
+    arg_parser.add_argument('--clang', default = 'clang', help = 'clang executable to use')
+    arg_parser.add_argument('--inline-threshold', metavar = 'N', type = int, default = default_threshold,
+                            help = 'inline functions of up to N AST nodes, 0 turns inlining off')
+    arg_parser.add_argument('--emit-llvm', action = 'store_true',
+                            help = 'write the LLVM IR to output instead of building an executable')
+    arg_parser.add_argument('--stats', metavar = 'FILE',
+                            help = 'write the time, memory and IR size of every pass to FILE as JSON')
+    arg_parser.add_argument('--trace', metavar = 'FILE',
+                            help = 'write the same measurements to FILE as Chrome trace events')
+    args = arg_parser.parse_args()
+    filename = args.filename
+    output = args.output
+    instrumentation = Instrumentation() if args.stats or args.trace else None
+    if instrumentation is None:
+        syntax_tree = file_to_AST(f'tests/{filename}')
+    else:
+        syntax_tree = instrumentation.measure('parse', file_to_AST, f'tests/{filename}')
+    cache = FunctionCache(args.cache) if args.cache else None
+    inliner = Inliner(args.inline_threshold)
+    write_ir = lambda file: emit_module(syntax_tree, file, cache, args.jobs, inliner, args.opt_level, instrumentation)
+    if args.emit_llvm:
+        with open(output, 'w', buffering = 1 << 16) as file:
+            write_ir(file)
+    else:
+        try:
+            Toolchain(args.clang, args.opt_level, args.target).build(write_ir, output)
+        except ClangNotFound as e:
+            sys.exit(str(e))
+    if cache is not None:
+        print(cache.report())
+    if inliner.inlined:
+        print(inliner.report())
+    if instrumentation is not None:
+        instrumentation.stop()
+        if args.stats:
+            with open(args.stats, 'w') as file:
+                file.write(instrumentation.to_json() + '\n')
+        if args.trace:
+            with open(args.trace, 'w') as file:
+                file.write(instrumentation.to_chrome_trace() + '\n')
+        print(instrumentation.report())
     print(f'Compiled {filename} to {output}')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,19 +2,13 @@
 
 from model import *
 from instructionsmodel import *
+from typing import Iterator
+import itertools
 
-# Label count
-count = 0
-# Every label made at this stage will begin with B
-
-def get_label():
-    global count
-    count += 1
-    return count - 1
+# Every label made at this stage will begin with B. Labels only need to be unique within a
+# function, so each function gets its own label counter, which is passed down as labels.
 
 def add_control_flow(program : Program) -> Program:
-    global count
-    count = 0
     return Program(control_statements(program.statements))
     
 # This is the top-level of the program, so every statement here will be a global var declaration
@@ -29,7 +23,7 @@ def control_statements(statements : list[Statement]) -> list[Statement]:
                 out.append(s)
             else:
                 out.append(FunctionDefinition(s.name, s.parameters, 
-                                              statements_to_blocks(s.body[:-1], s.body[-1]) + [s.body[-1]]))
+                                              statements_to_blocks(s.body[:-1], s.body[-1], itertools.count()) + [s.body[-1]]))
         else:
             raise RuntimeError(f'Unexpected statement type {s} when linking blocks')
     return out
@@ -39,6 +33,7 @@ def control_statements(statements : list[Statement]) -> list[Statement]:
 # For each BLOCK, we need to insert a GOTO
 # For each If, we need to provide CBRANCH(true block, false block)
 # For each While, we need to provide CBRANCH(body, post-loop)
+# An and/or test gives a CBRANCH for each of its operands instead (see test_blocks)
 # Iterate backwards through the blocks, passing the destination block to earlier blocks
 # Key idea: When we process the If statement consequence and alternative blocks,
 # we need to provide a destination for these blocks, which is outside the scope of the original if statement
@@ -49,11 +44,15 @@ def control_statements(statements : list[Statement]) -> list[Statement]:
 # If/While statements, which are not yet converted to blocks
 # We can either turn these all to blocks first, but this would require extra bookkeeping for nested levels
 # Alternatively, if we process backwards, then we are guaranteed the future block is already a block.
+# An InlinedBody is laid out like a plain list of statements, except that every LeaveInlined
+# with its label becomes a block that jumps to whatever follows the body. exits maps the labels
+# of the InlinedBodys being processed to those blocks.
 # returns a list of BLOCKs, forward direction
-def statements_to_blocks(statements : list[Statement], next_block : BLOCK) -> list[Statement]: 
+def statements_to_blocks(statements : list[Statement], next_block : BLOCK, labels : Iterator[int],
+                         exits : dict | None = None) -> list[Statement]: 
     if statements == []:
-        return [BLOCK(f'B{get_label()}', [GOTO(next_block)])]
-    # each statement here is a BLOCK, IF, or WHILE
+        return [BLOCK(f'B{next(labels)}', [GOTO(next_block)])]
+    # each statement here is a BLOCK, IF, WHILE, InlinedBody or LeaveInlined
     new_statements = []
     for statement in statements[-1::-1]:
         match statement:
@@ -61,17 +60,39 @@ def statements_to_blocks(statements : list[Statement], next_block : BLOCK) -> li
                 new_statements.append(BLOCK(statement.label, statement.instructions + [GOTO(next_block)]))
                 next_block = new_statements[-1]
             case If(test, consequence, alternative):
-                consequence_blocks = statements_to_blocks(consequence, next_block)
-                alternative_blocks = statements_to_blocks(alternative, next_block)
-                test_block = BLOCK(f'B{get_label()}', test.instructions + [CBRANCH(consequence_blocks[0], alternative_blocks[0])])
-                new_statements = new_statements + alternative_blocks[::-1] + consequence_blocks[::-1] + [test_block]
+                consequence_blocks = statements_to_blocks(consequence, next_block, labels, exits)
+                alternative_blocks = statements_to_blocks(alternative, next_block, labels, exits)
+                test = test_blocks(test, consequence_blocks[0], alternative_blocks[0], labels)
+                new_statements = new_statements + alternative_blocks[::-1] + consequence_blocks[::-1] + test[::-1]
                 next_block = new_statements[-1]
             case While(test, body):
                 test_block = BLOCK("", []) # dummy
-                body_blocks = statements_to_blocks(body, test_block)
-                test_block.label = f'B{get_label()}'
-                test_block.instructions = test.instructions + [CBRANCH(body_blocks[0], next_block)]
-                new_statements = new_statements + body_blocks[::-1] + [test_block]
+                body_blocks = statements_to_blocks(body, test_block, labels, exits)
+                test = test_blocks(test, body_blocks[0], next_block, labels)
+                test_block.label = test[0].label
+                test_block.instructions = test[0].instructions
+                new_statements = new_statements + body_blocks[::-1] + test[:0:-1] + [test_block]
+                next_block = new_statements[-1]
+            case InlinedBody(_, label, body):
+                body_blocks = statements_to_blocks(body, next_block, labels, {**(exits or {}), label : next_block})
+                new_statements = new_statements + body_blocks[::-1]
+                next_block = new_statements[-1]
+            case LeaveInlined(label):
+                new_statements.append(BLOCK(f'B{next(labels)}', [GOTO(exits[label])]))
                 next_block = new_statements[-1]
     new_statements.reverse()
-    return new_statements
\ No newline at end of file
+    return new_statements
+
+# The blocks that evaluate a test and jump to true_block or false_block, forward direction.
+# The operands of an and/or each get their own blocks, and the left one jumps past the right
+# one when it decides the result, so the right one is only evaluated when it is needed.
+def test_blocks(test : Expression, true_block : BLOCK, false_block : BLOCK, labels : Iterator[int]) -> list[BLOCK]:
+    match test:
+        case LogicalOp('and', left, right):
+            right_blocks = test_blocks(right, true_block, false_block, labels)
+            return test_blocks(left, right_blocks[0], false_block, labels) + right_blocks
+        case LogicalOp('or', left, right):
+            right_blocks = test_blocks(right, true_block, false_block, labels)
+            return test_blocks(left, true_block, right_blocks[0], labels) + right_blocks
+        case _:
+            return [BLOCK(f'B{next(labels)}', test.instructions + [CBRANCH(true_block, false_block)])]
\ No newline at end of file
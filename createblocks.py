@@ -2,17 +2,17 @@
 
 from model import *
 from instructionsmodel import *
+from typing import Iterator
+import itertools
 
-count = 0
+# Labels only need to be unique within a function, so each function gets its own label counter,
+# which is passed down to its nested statements
 
 def create_blocks(program : Program) -> Program:
-    global count
-    count = 0
-    return Program(create_blocks_statements(program.statements))
+    return Program(create_blocks_statements(program.statements, itertools.count()))
 
 
-def create_blocks_statements(statements : list[Statement]) -> list[Statement]:
-    global count
+def create_blocks_statements(statements : list[Statement], labels : Iterator[int]) -> list[Statement]:
     out = []
     cur_block = []
     for s in statements:
@@ -22,22 +22,24 @@ def create_blocks_statements(statements : list[Statement]) -> list[Statement]:
             cur_block.append(s)
         else:
             if cur_block:
-                label = f'L{count}'
-                count += 1
+                label = f'L{next(labels)}'
                 out.append(BLOCK(label, [ins for statement in cur_block for ins in statement.instructions]))
                 cur_block = []
             match s:
                 case If(test, consequence, alternative):
                     out.append(If(test, 
-                               create_blocks_statements(consequence), 
-                               create_blocks_statements(alternative)))
+                               create_blocks_statements(consequence, labels), 
+                               create_blocks_statements(alternative, labels)))
                 case While(test, body):
-                    out.append(While(test, create_blocks_statements(body)))
+                    out.append(While(test, create_blocks_statements(body, labels)))
+                case InlinedBody(name, label, body):
+                    out.append(InlinedBody(name, label, create_blocks_statements(body, labels)))
+                case LeaveInlined():
+                    out.append(s)
                 case FunctionDefinition(name, parameters, body):
                     out.append(FunctionDefinition(name, parameters,
-                                                  create_blocks_statements(body)))
+                                                  create_blocks_statements(body, itertools.count())))
     if cur_block:
-        label = f'L{count}'
-        count += 1
+        label = f'L{next(labels)}'
         out.append(BLOCK(label, [ins for statement in cur_block for ins in statement.instructions]))
     return out
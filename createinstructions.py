@@ -18,9 +18,11 @@ def statement_to_instructions(s : Statement) -> Statement:
             value = expression_to_instructions(e)
             return STATEMENT(value.instructions + [get_assignment(name, e)])
         case If(test, consequence, alternative):
-            return If(expression_to_instructions(test), convert_statements(consequence), convert_statements(alternative))
+            return If(test_to_instructions(test), convert_statements(consequence), convert_statements(alternative))
         case While(test, body):
-            return While(expression_to_instructions(test), convert_statements(body))
+            return While(test_to_instructions(test), convert_statements(body))
+        case InlinedBody(name, label, body):
+            return InlinedBody(name, label, convert_statements(body))
         case FunctionDefinition(name, parameters, body):
             return FunctionDefinition(name, parameters, convert_statements(body))
         case Return(e):
@@ -33,25 +35,35 @@ def statement_to_instructions(s : Statement) -> Statement:
         case _:
             return s
 
+# An and/or test keeps its shape, with an EXPR for each operand, and becomes branches in controlflow
+def test_to_instructions(test : Expression) -> Expression:
+    match test:
+        case LogicalOp(op, left, right):
+            return LogicalOp(test.wtype, op, test_to_instructions(left), test_to_instructions(right))
+        case _:
+            return expression_to_instructions(test)
+
 def get_print(e : Expression) -> INSTRUCTION:
     match e.wtype:
         case 'int':
             return PRINT()
         case 'float':
             return FPRINT()
+        case 'char':
+            return CPRINT()
         case _:
             raise RuntimeError(f'Unknown type for print {e}')
     
 def get_assignment(name : Identifier, e : Expression) -> INSTRUCTION:
     if isinstance(name, GlobalId):
-        if name.wtype == 'int':
+        if name.wtype in ('int', 'char'):
             return STORE_GLOBAL(name.string)
         elif name.wtype == 'float':
             return FSTORE_GLOBAL(name.string)
         else:
             raise RuntimeError(f'Unknown type for assignment {name} {GlobalId}')
     elif isinstance(name, LocalId):
-        if name.wtype == 'int':
+        if name.wtype in ('int', 'char'):
             return STORE_LOCAL(name.string)
         elif name.wtype == 'float':
             return FSTORE_LOCAL(name.string)
@@ -71,28 +83,39 @@ def get_return(e : Expression) -> INSTRUCTION:
 
 def get_local_dec(name : Identifier) -> INSTRUCTION:
     match name.wtype:
-        case 'int':
+        case 'int' | 'char':
             return LOCAL(name.string)
         case 'float':
             return FLOCAL(name.string)
         case _:
             raise RuntimeError(f'Unknown type for local declaration {name}')
 
+escapes = {'n' : '\n', 't' : '\t', '\\' : '\\', "'" : "'", '0' : '\0'}
+
+def char_code(c : str) -> int: # The tokenizer keeps escapes such as '\n' as two characters
+    if len(c) == 2 and c[0] == '\\' and c[1] in escapes:
+        return ord(escapes[c[1]])
+    if len(c) != 1:
+        raise RuntimeError(f'Invalid character constant {c}')
+    return ord(c)
+
 def expression_to_instructions(expr : Expression) -> EXPR:
     match expr:
         case Integer(n):
             return EXPR([PUSH(n)])
         case Float(n):
             return EXPR([FPUSH(n)])
+        case Character(c):
+            return EXPR([PUSH(char_code(c))])
         case GlobalId(string, wtype=wtype):
-            if wtype == 'int':
+            if wtype in ('int', 'char'):
                 return EXPR([LOAD_GLOBAL(string)])
             elif wtype == 'float':
                 return EXPR([FLOAD_GLOBAL(string)])
             else:
                 raise RuntimeError(f'Unknown type for {expr}')
         case LocalId(string, wtype=wtype):
-            if wtype == 'int':
+            if wtype in ('int', 'char'):
                 return EXPR([LOAD_LOCAL(string)])
             elif wtype == 'float':
                 return EXPR([FLOAD_LOCAL(string)])
@@ -111,6 +134,8 @@ def expression_to_instructions(expr : Expression) -> EXPR:
                     op_instr = 'MULT'
                 case '/':
                     op_instr = 'DIVIDE'
+                case '<<':
+                    op_instr = 'SHL'
                 case '<':
                     op_instr = 'LT'
                 case '<=':
@@ -125,10 +150,13 @@ def expression_to_instructions(expr : Expression) -> EXPR:
                     op_instr = 'NE'
                 case _:
                     raise RuntimeError(f'Unknown operation {op} found')
-            if expr.wtype == 'float':
+            if left.wtype == 'float': # the operands' type, as relations on floats are ints
                 op_instr = 'F' + op_instr
             return EXPR(left_instr.instructions + 
                         right_instr.instructions + [globals()[op_instr]()])
+        case UnaryOp('-', exp):
+            neg = FNEG() if expr.wtype == 'float' else NEG()
+            return EXPR(expression_to_instructions(exp).instructions + [neg])
         case FunctionCall(name, arguments):
             args_exprs = [expression_to_instructions(a) for a in arguments]
             args_instr = [instr for exp in args_exprs for instr in exp.instructions ]
@@ -0,0 +1,90 @@
+# driver.py
+
+from typing import Callable, TextIO
+import hashlib
+import os
+import subprocess
+import tempfile
+
+# Drives clang for a single build:
+# - the IR is streamed to clang over stdin, so it never has to be written to a file
+# - every build gets its own temporary directory (also used as clang's TMPDIR), and the
+#   executable is moved into place only once it is complete, so concurrent builds can't
+#   clobber each other
+# - runtime.c is compiled to an object file once per toolchain configuration and reused
+
+runtime_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runtime.c')
+
+# Raised when the clang executable can't be found, so the CLIs can say so without a traceback
+class ClangNotFound(RuntimeError):
+    def __init__(self, clang : str):
+        super().__init__(f'clang not found: {clang!r} is not installed or not on PATH (choose another with --clang)')
+
+def default_cache_dir() -> str:
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'wabbit')
+
+class Toolchain:
+    def __init__(self, clang : str = 'clang', opt_level : int = 0, target : str | None = None,
+                 flags : list[str] | None = None, cache_dir : str | None = None):
+        if opt_level not in (0, 1, 2, 3):
+            raise ValueError(f'Invalid optimization level {opt_level}')
+        self.clang = clang
+        self.opt_level = opt_level
+        self.target = target
+        self.flags = flags or []
+        self.cache_dir = cache_dir or default_cache_dir()
+
+    def codegen_flags(self) -> list[str]:
+        flags = [f'-O{self.opt_level}']
+        if self.target:
+            flags.append(f'--target={self.target}')
+        return flags + self.flags
+
+    def run(self, args : list[str], stdin = None, env = None) -> subprocess.Popen:
+        try:
+            return subprocess.Popen([self.clang] + args, stdin = stdin, stderr = subprocess.PIPE,
+                                    text = True, env = env)
+        except FileNotFoundError:
+            raise ClangNotFound(self.clang) from None
+
+    # Arguments to compile IR (a file, or '-' for stdin) and link it with the runtime object
+    def link_args(self, ir_input : str, runtime : str, output : str) -> list[str]:
+        return self.codegen_flags() + ['-x', 'ir', ir_input, '-x', 'none', runtime, '-o', output]
+
+    def runtime_object(self) -> str:
+        with open(runtime_source, 'rb') as file:
+            source = file.read()
+        digest = hashlib.sha256(source)
+        digest.update(repr([self.clang] + self.codegen_flags()).encode())
+        path = os.path.join(self.cache_dir, f'runtime-{digest.hexdigest()[:16]}.o')
+        if os.path.exists(path):
+            return path
+        os.makedirs(self.cache_dir, exist_ok = True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        process = self.run(self.codegen_flags() + ['-c', runtime_source, '-o', temp_path])
+        _, errors = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f'Compiling {runtime_source} failed:\n{errors}')
+        os.replace(temp_path, path) # another build may have done the same, either copy is fine
+        return path
+
+    # write_ir is called with clang's stdin and should write the whole module to it
+    def build(self, write_ir : Callable[[TextIO], None], output : str):
+        runtime = self.runtime_object()
+        # Next to the output, so that the final rename stays on one filesystem
+        output_dir = os.path.dirname(os.path.abspath(output))
+        with tempfile.TemporaryDirectory(prefix = '.wabbit-build-', dir = output_dir) as build_dir:
+            temp_output = os.path.join(build_dir, os.path.basename(output))
+            env = dict(os.environ, TMPDIR = build_dir)
+            process = self.run(self.link_args('-', runtime, temp_output),
+                               stdin = subprocess.PIPE, env = env)
+            try:
+                write_ir(process.stdin)
+                process.stdin.close()
+            except BrokenPipeError: # clang gave up early, its stderr says why
+                pass
+            errors = process.stderr.read()
+            if process.wait() != 0:
+                raise RuntimeError(f'clang failed to build {output}:\n{errors}')
+            os.replace(temp_output, output)
@@ -1,56 +1,206 @@
 from model import *
+from passes import Pass, run_passes
 
 def fold_constants(program : Program) -> Program:
-    return Program(fold_statements(program.statements))
-
-def fold_statements(statements : list[Statement]) -> list[Statement]:
-    return [fold_statement(s) for s in statements]
-
-def fold_statement(s : Statement) -> Statement:
-    match s:
-        case Print(e):
-            return Print(fold_expression(e))
-        case Assignment(name, e):
-            return Assignment(name, fold_expression(e))
-        case If(test, consequence, alternative):
-            return If(fold_expression(test), fold_statements(consequence), fold_statements(alternative))
-        case While(test, body):
-            return While(fold_expression(test), fold_statements(body))
-        case FunctionDefinition(name, parameters, body):
-            return FunctionDefinition(name, parameters, fold_statements(body))
-        case Return(value):
-            return Return(fold_expression(value))
-        case ExprStatement(value):
-            return ExprStatement(fold_expression(value))
-        case VariableDeclaration():
-            return s
-        case Variable(name, value):
-            return Variable(name, fold_expression(value))
+    return run_passes(program, [FoldConstants()])
+
+def propagate_constants(program : Program) -> Program:
+    return run_passes(program, [PropagateConstants()])
+
+def wrap(n : int) -> int: # Integer arithmetic is 32-bit, as in the VM and the LLVM output
+    return ((n + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+# Relations evaluate to 1 or 0, the same as the VM's LT/EQ/... instructions
+relations = {
+    '<' : lambda l, r: l < r,
+    '<=' : lambda l, r: l <= r,
+    '>' : lambda l, r: l > r,
+    '>=' : lambda l, r: l >= r,
+    '==' : lambda l, r: l == r,
+    '!=' : lambda l, r: l != r,
+}
+
+# Returns the constant result of l op r, or None if it can't be computed at compile time.
+# Division by zero is left alone so that it still fails at runtime.
+def fold(op : str, left : Expression, right : Expression) -> Expression | None:
+    match left, right:
+        case Integer(l), Integer(r):
+            match op:
+                case '+':
+                    return Integer(wrap(l + r))
+                case '-':
+                    return Integer(wrap(l - r))
+                case '*':
+                    return Integer(wrap(l * r))
+                case '/':
+                    if r == 0:
+                        return None
+                    quotient = abs(l) // abs(r) # truncates towards zero, like sdiv
+                    return Integer(wrap(quotient if (l < 0) == (r < 0) else -quotient))
+                case '<<':
+                    return Integer(wrap(l << r))
+        case Float(l), Float(r):
+            match op:
+                case '+':
+                    return Float(l + r)
+                case '-':
+                    return Float(l - r)
+                case '*':
+                    return Float(l * r)
+                case '/':
+                    return Float(l / r) if r != 0.0 else None
         case _:
-            raise RuntimeError(f"Can't fold {s}")
-        
-def fold_expression(e : Expression) -> Expression:
+            return None
+    if op in relations:
+        return Integer(1 if relations[op](l, r) else 0)
+    raise RuntimeError(f'Unsupported operation type {op}')
+
+def is_constant(e : Expression) -> bool:
+    return isinstance(e, (Integer, Float))
+
+class FoldConstants(Pass):
+    # Operands have already been folded by the time a BinaryOp or UnaryOp is seen
+    def expression(self, e : Expression) -> Expression:
+        match e:
+            case BinaryOp(op, left, right):
+                folded = fold(op, left, right)
+                return e if folded is None else folded
+            case UnaryOp('-', Integer(n)):
+                return Integer(wrap(-n))
+            case UnaryOp('-', Float(n)):
+                return Float(-n)
+            case LogicalOp(op, left, right) if is_constant(left):
+                if (left.n != 0) == (op == 'or'): # 1 or x, 0 and x
+                    return Integer(1 if op == 'or' else 0)
+                if is_constant(right):
+                    return Integer(1 if right.n != 0 else 0)
+                return e
+            case _:
+                return e
+
+# Runs after front_end, once identifiers are resolved, and replaces variables that can only hold
+# one constant value by that value, folding again as it goes. Like the VM and the LLVM backend,
+# it treats every local of the same name in a function as one variable. Such a variable is:
+#   - a local declared once and assigned once, directly after its declaration (var x = 1.0;)
+#   - a global assigned once in the whole program, at the start of main, before anything that
+#     could call a function. Every other function can only run after that assignment.
+# Declarations and stores are kept, only reads are replaced. If statements with a constant test
+# are replaced by the branch that is taken, and loops that never run are removed.
+class PropagateConstants(FoldConstants):
+    def __init__(self):
+        self.globals = {} # global name -> value, for globals with a single constant assignment
+        self.constants = {} # (GlobalId or LocalId, name) -> value known at this point
+        self.local_writes = {} # local name -> declarations and assignments in this function
+        self.declared = None # local declared by the statement just before, if any
+        self.in_main = False
+
+    def enter_block(self, owner : ASTNode):
+        self.declared = None
+        match owner:
+            case Program(statements):
+                self.globals = find_global_constants(statements)
+            case FunctionDefinition(name, parameters, body):
+                self.in_main = name.string == 'main'
+                self.constants = {} if self.in_main else {(GlobalId, n) : v for n, v in self.globals.items()}
+                self.local_writes = {p.string : 1 for p in parameters.data}
+                count_local_writes(body, self.local_writes)
+
+    def expression(self, e : Expression) -> Expression:
+        if isinstance(e, (GlobalId, LocalId)):
+            return self.constants.get((type(e), e.string), e)
+        return FoldConstants.expression(self, e)
+
+    def statement(self, s : Statement) -> list[Statement]:
+        declared, self.declared = self.declared, None
+        match s:
+            case LocalVarDec(name):
+                self.declared = name.string
+            case Assignment(LocalId(name), value) if is_constant(value):
+                if name == declared and self.local_writes.get(name) == 2:
+                    self.constants[(LocalId, name)] = value
+            case Assignment(GlobalId(name)) if self.in_main and name in self.globals:
+                self.constants[(GlobalId, name)] = self.globals[name]
+            case If(Integer(n), consequence, alternative):
+                return consequence if n else alternative
+            case While(Integer(0)):
+                return []
+        return [s]
+
+def find_global_constants(statements : list[Statement]) -> dict:
+    writes = {}
+    main = None
+    for s in statements:
+        if isinstance(s, FunctionDefinition):
+            count_global_writes(s.body, writes)
+            if s.name.string == 'main':
+                main = s
+    constants = {}
+    if main is None:
+        return constants
+    for s in main.body:
+        match s:
+            case Assignment(GlobalId(name), value) if not contains_call(value):
+                value = evaluate(value, constants)
+                if value is not None and writes[name] == 1:
+                    constants[name] = value
+            case Print(value) if not contains_call(value):
+                pass
+            case _:
+                break
+    return constants
+
+# The constant value of e given the globals found so far, or None
+def evaluate(e : Expression, constants : dict) -> Expression | None:
     match e:
+        case Integer() | Float():
+            return e
+        case GlobalId(name):
+            return constants.get(name)
         case BinaryOp(op, left, right):
-            folded_left = fold_expression(left)
-            folded_right = fold_expression(right)
-            match (folded_left, folded_right):
-                case (Integer(l), Integer(r)):
-                    if op == '+':
-                        return Integer(l+r)
-                    elif op == '*':
-                        return Integer(l*r)
-                    elif op == '<' or '==':
-                        return e
-                    else:
-                        raise RuntimeError(f"Unsupport operation type {op}")
-                case _:
-                    return BinaryOp("", op, folded_left, folded_right)
-        case UnaryOp(op, exp):
-            folded_exp = fold_expression(exp)
-            return UnaryOp("", op, folded_exp)
-        case FunctionCall(name, arguments):
-            new_args = [fold_expression(exp) for exp in arguments]
-            return FunctionCall(name.wtype, name, new_args)
+            left = evaluate(left, constants)
+            right = evaluate(right, constants)
+            if left is None or right is None:
+                return None
+            return fold(op, left, right)
+        case UnaryOp('-', exp):
+            match evaluate(exp, constants):
+                case Integer(n):
+                    return Integer(wrap(-n))
+                case Float(n):
+                    return Float(-n)
+            return None
+        case _:
+            return None
+
+def contains_call(e : Expression) -> bool:
+    match e:
+        case FunctionCall():
+            return True
+        case BinaryOp(_, left, right) | LogicalOp(_, left, right):
+            return contains_call(left) or contains_call(right)
+        case UnaryOp(_, exp):
+            return contains_call(exp)
         case _:
-            return e
\ No newline at end of file
+            return False
+
+def count_global_writes(statements : list[Statement], writes : dict):
+    for s in statements:
+        match s:
+            case Assignment(GlobalId(name)):
+                writes[name] = writes.get(name, 0) + 1
+            case If(_, consequence, alternative):
+                count_global_writes(consequence, writes)
+                count_global_writes(alternative, writes)
+            case While(_, body) | InlinedBody(_, _, body):
+                count_global_writes(body, writes)
+
+def count_local_writes(statements : list[Statement], writes : dict):
+    for s in statements:
+        match s:
+            case LocalVarDec(name) | Assignment(LocalId() as name):
+                writes[name.string] = writes.get(name.string, 0) + 1
+            case If(_, consequence, alternative):
+                count_local_writes(consequence, writes)
+                count_local_writes(alternative, writes)
+            case While(_, body) | InlinedBody(_, _, body):
+                count_local_writes(body, writes)
@@ -30,6 +30,8 @@ def format_expression(e : Expression) -> str:
             return f'{format_expression(left)} {op} {format_expression(right)}'
         case UnaryOp(op, exp):
             return f'-{format_expression(exp)}'
+        case LogicalOp(op, left, right):
+            return f'({format_expression(left)} {op} {format_expression(right)})'
         case Parameters(data):
             return ", ".join([format_expression(v) for v in data])
         case FunctionCall(name, arguments):
@@ -90,6 +92,13 @@ def format_statement(s : Statement, level) -> str:
             return code
         case ExprStatement(exp):
             return format_expression(exp) + '\n'
+        case InlinedBody(name, label, body):
+            code = f'inlined {format_expression(name)} as {label} {{\n'
+            code += format_statements(body, level + 1)
+            code += indent * level + f'}}\n'
+            return code
+        case LeaveInlined(label):
+            return f'leave {label};\n'
         case _:
             raise RuntimeError(f'Can\'t format {s}')
 
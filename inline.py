@@ -0,0 +1,278 @@
+# inline.py
+
+from model import *
+from passes import Pass, run_passes, child_fields, EXPRESSION, EXPRESSION_LIST
+
+# Replaces calls to small, non-recursive functions by a copy of the function's body.
+# Runs on the output of the resolving passes, where every function is top-level and identifiers
+# are already GlobalId/LocalId. For a statement such as  x = f(a, b) + 1;  it produces
+#     local f.0.p; f.0.p = a;          one local per parameter, holding the argument
+#     local f.0.q; f.0.q = b;
+#     local f.0;                       the result of the call
+#     inlined f as f.0 { ... }         the body of f, with its locals renamed to f.0.*
+#     x = local[f.0] + 1;
+# and every `return v;` in the body becomes `f.0 = v; leave f.0;`, where leave jumps to just
+# after the inlined body. Source identifiers can't contain '.', so the new names never clash.
+# Labels of inlined bodies already inside f get the same prefix, so they stay unique.
+#
+# The call is evaluated before the rest of its statement, so a call site is only inlined when
+# that can't be told apart from the original order: the statement must contain no other call,
+# and must not read a global that f (or anything it calls) may assign. Calls in While tests are
+# left alone, since the test is evaluated again on every iteration, and so are calls in the right
+# operand of an `and` or `or` in an If test, which may not be evaluated at all.
+#
+# Functions are processed callees first, so a function that is inlined already has its own
+# calls inlined. Functions on a cycle of the call graph are never inlined, and neither are
+# functions whose body is bigger than threshold nodes (0 disables inlining).
+
+default_threshold = 80
+
+class Inliner:
+    def __init__(self, threshold : int = default_threshold):
+        self.threshold = threshold
+        self.inlined = [] # (caller, callee) for every inlined call
+
+    def run(self, program : Program) -> Program:
+        if self.threshold <= 0:
+            return program
+        self.functions = {s.name.string : s for s in program.statements if isinstance(s, FunctionDefinition)}
+        self.calls = {name : called_functions(f.body) for name, f in self.functions.items()}
+        self.recursive = {name for name in self.functions if name in reachable(name, self.calls)}
+        self.writes = global_writes(self.functions, self.calls)
+        self.sizes = {}
+        self.count = 0
+        for name in post_order(self.functions, self.calls):
+            function = self.functions[name]
+            body = self.inline_statements(function.body, name)
+            if body is not function.body:
+                function = FunctionDefinition(function.name, function.parameters, body)
+                self.functions[name] = function
+            self.sizes[name] = tree_size(function.body)
+        return Program([self.functions[s.name.string] if isinstance(s, FunctionDefinition) else s
+                        for s in program.statements])
+
+    def report(self) -> str:
+        if not self.inlined:
+            return 'Inlined no calls'
+        counts = {}
+        for caller, callee in self.inlined:
+            counts[(caller, callee)] = counts.get((caller, callee), 0) + 1
+        sites = ', '.join(f'{callee} into {caller}' + (f' (x{n})' if n > 1 else '')
+                          for (caller, callee), n in counts.items())
+        return f'Inlined {len(self.inlined)} calls: {sites}'
+
+    def inline_statements(self, statements : list[Statement], caller : str) -> list[Statement]:
+        out = []
+        changed = False
+        for s in statements:
+            match s:
+                case If(test, consequence, alternative):
+                    new_s = If(test, self.inline_statements(consequence, caller),
+                               self.inline_statements(alternative, caller))
+                    if new_s.consequence is consequence and new_s.alternative is alternative:
+                        new_s = s
+                    new_statements = self.inline_call(new_s, test, caller)
+                case While(test, body):
+                    new_body = self.inline_statements(body, caller)
+                    new_statements = [s if new_body is body else While(test, new_body)]
+                case InlinedBody(name, label, body):
+                    new_body = self.inline_statements(body, caller)
+                    new_statements = [s if new_body is body else InlinedBody(name, label, new_body)]
+                case Assignment(_, e) | Print(e) | ExprStatement(e) | Return(e):
+                    new_statements = self.inline_call(s, e, caller)
+                case _:
+                    new_statements = [s]
+            if len(new_statements) != 1 or new_statements[0] is not s:
+                changed = True
+            out += new_statements
+        return out if changed else statements
+
+    # Inlines the call in e, the expression evaluated first by statement s, if it is allowed
+    def inline_call(self, s : Statement, e : Expression, caller : str) -> list[Statement]:
+        calls = [node for node in expression_nodes(e) if isinstance(node, FunctionCall)]
+        if len(calls) != 1:
+            return [s]
+        call = calls[0]
+        if any(isinstance(node, LogicalOp) and any(n is call for n in expression_nodes(node.right))
+               for node in expression_nodes(e)):
+            return [s]
+        name = call.name.string
+        if (name not in self.sizes or name in self.recursive or name == caller
+                or self.sizes[name] > self.threshold or call.wtype not in ('int', 'float', 'char')):
+            return [s]
+        others = [node for node in expression_nodes(e, skip = call)]
+        if any(isinstance(node, GlobalId) and node.string in self.writes[name] for node in others):
+            return [s]
+
+        callee = self.functions[name]
+        prefix = f'{name}.{self.count}'
+        self.count += 1
+        self.inlined.append((caller, name))
+        out = []
+        for param, argument in zip(callee.parameters.data, call.arguments):
+            local = LocalId(param.wtype, f'{prefix}.{param.string}')
+            out.append(LocalVarDec(Identifier(param.wtype, local.string)))
+            out.append(Assignment(local, argument))
+        result = LocalId(call.wtype, prefix)
+        out.append(LocalVarDec(Identifier(call.wtype, prefix)))
+        body = run_passes(Program(callee.body), [RenameLocals(prefix, result)]).statements
+        out.append(InlinedBody(Identifier(call.wtype, name), prefix, body))
+        out.append(replace_expression(s, call, result))
+        return out
+
+# Gives the locals of an inlined body their new names, and turns its Returns into jumps
+class RenameLocals(Pass):
+    def __init__(self, prefix : str, result : LocalId):
+        self.prefix = prefix
+        self.result = result
+
+    def rename(self, name : Identifier) -> str:
+        return f'{self.prefix}.{name.string}'
+
+    def expression(self, e : Expression) -> Expression:
+        if isinstance(e, LocalId):
+            return LocalId(e.wtype, self.rename(e))
+        return e
+
+    def statement(self, s : Statement) -> list[Statement]:
+        match s:
+            case LocalVarDec(name):
+                return [LocalVarDec(Identifier(name.wtype, self.rename(name)))]
+            case Assignment(LocalId() as name, value):
+                return [Assignment(LocalId(name.wtype, self.rename(name)), value)]
+            case Return(value):
+                return [Assignment(self.result, value), LeaveInlined(self.prefix)]
+            case InlinedBody(name, label, body): # already in the callee, from tail calls or inlining
+                return [InlinedBody(name, f'{self.prefix}.{label}', body)]
+            case LeaveInlined(label):
+                return [LeaveInlined(f'{self.prefix}.{label}')]
+            case _:
+                return [s]
+
+# Every expression node in e, except those inside skip
+def expression_nodes(e : Expression, skip : Expression | None = None):
+    stack = [e]
+    while stack:
+        node = stack.pop()
+        if node is skip:
+            continue
+        yield node
+        for name, kind in child_fields(type(node)):
+            value = getattr(node, name)
+            if kind == EXPRESSION:
+                stack.append(value)
+            elif kind == EXPRESSION_LIST:
+                stack.extend(value)
+
+def replace_expression(s : Statement, old : Expression, new : Expression) -> Statement:
+    def replace(e : Expression) -> Expression:
+        if e is old:
+            return new
+        match e:
+            case BinaryOp(op, left, right):
+                return BinaryOp(e.wtype, op, replace(left), replace(right))
+            case UnaryOp(op, exp):
+                return UnaryOp(e.wtype, op, replace(exp))
+            case LogicalOp(op, left, right):
+                return LogicalOp(e.wtype, op, replace(left), replace(right))
+            case FunctionCall(name, arguments):
+                return FunctionCall(e.wtype, name, [replace(a) for a in arguments])
+            case _:
+                return e
+    match s:
+        case Assignment(name, value):
+            return Assignment(name, replace(value))
+        case Print(value):
+            return Print(replace(value))
+        case ExprStatement(value):
+            return ExprStatement(replace(value))
+        case Return(value):
+            return Return(replace(value))
+        case If(test, consequence, alternative):
+            return If(replace(test), consequence, alternative)
+        case _:
+            raise RuntimeError(f'Unexpected statement {s} when inlining')
+
+def statement_expressions(statements : list[Statement]):
+    # Every expression node in a list of statements, including nested blocks
+    for s in statements:
+        for name, kind in child_fields(type(s)):
+            value = getattr(s, name)
+            if kind == EXPRESSION:
+                yield from expression_nodes(value)
+            elif kind == EXPRESSION_LIST:
+                for e in value:
+                    yield from expression_nodes(e)
+            else:
+                yield from statement_expressions(value)
+
+def called_functions(statements : list[Statement]) -> set[str]:
+    return {e.name.string for e in statement_expressions(statements) if isinstance(e, FunctionCall)}
+
+def assigned_globals(statements : list[Statement]) -> set[str]:
+    names = set()
+    for s in statements:
+        match s:
+            case Assignment(GlobalId(name)):
+                names.add(name)
+            case If(_, consequence, alternative):
+                names |= assigned_globals(consequence) | assigned_globals(alternative)
+            case While(_, body) | InlinedBody(_, _, body):
+                names |= assigned_globals(body)
+    return names
+
+def tree_size(statements : list[Statement]) -> int:
+    size = len(statements)
+    for s in statements:
+        for name, kind in child_fields(type(s)):
+            if kind == EXPRESSION:
+                size += sum(1 for _ in expression_nodes(getattr(s, name)))
+            elif kind == EXPRESSION_LIST:
+                size += sum(1 for e in getattr(s, name) for _ in expression_nodes(e))
+            else:
+                size += tree_size(getattr(s, name))
+    return size
+
+# Function name -> globals that it, or anything it may call, assigns. Each body is only searched
+# once, as there can be as many reachable functions as there are functions.
+def global_writes(functions : dict, calls : dict) -> dict[str, set[str]]:
+    own = {name : assigned_globals(f.body) for name, f in functions.items()}
+    writes = {}
+    for name in functions:
+        writes[name] = set(own[name])
+        for callee in reachable(name, calls):
+            if callee in own:
+                writes[name] |= own[callee]
+    return writes
+
+# The functions that can be reached from name through one or more calls
+def reachable(name : str, calls : dict) -> set[str]:
+    seen = set()
+    stack = list(calls.get(name, ()))
+    while stack:
+        callee = stack.pop()
+        if callee not in seen:
+            seen.add(callee)
+            stack.extend(calls.get(callee, ()))
+    return seen
+
+# Function names ordered so that callees come before their callers (cycles in any order)
+def post_order(functions : dict, calls : dict) -> list[str]:
+    order = []
+    visited = set()
+    for root in functions:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(sorted(calls[root])))]
+        while stack:
+            name, callees = stack[-1]
+            for callee in callees:
+                if callee in functions and callee not in visited:
+                    visited.add(callee)
+                    stack.append((callee, iter(sorted(calls[callee]))))
+                    break
+            else:
+                stack.pop()
+                order.append(name)
+    return order
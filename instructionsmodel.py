@@ -13,191 +13,205 @@ CALL(name, n)       # Call function name with n arguments
 """
 
 # VM definitions
-@dataclass
+@dataclass(slots = True)
 class INSTRUCTION: pass
 
-@dataclass
+@dataclass(slots = True)
 class PUSH(INSTRUCTION):
     value : int
     def __str__(self):
         return f'PUSH({self.value})'
     
-@dataclass
+@dataclass(slots = True)
 class POP(INSTRUCTION): pass
 
-@dataclass
+@dataclass(slots = True)
 class ARITHMETIC(INSTRUCTION): pass
 
-@dataclass
+@dataclass(slots = True)
 class RELATION(INSTRUCTION): pass
 
-@dataclass
+@dataclass(slots = True)
 class ADD(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class MINUS(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class MULT(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class DIVIDE(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
+class SHL(ARITHMETIC): pass # Only made by the simplifier, for multiplying by a power of two
+
+@dataclass(slots = True)
+class NEG(INSTRUCTION): pass
+
+@dataclass(slots = True)
 class LT(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class LE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class GT(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class GE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class EQ(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class NE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class LOAD_GLOBAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOAD_GLOBAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class LOAD_LOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOAD_LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class CALL(INSTRUCTION):
     name : str
     return_type : str
     args : list[str]
     def __str__(self):
-        return f'CALL({self.name}, {self.num_args})'
+        return f'CALL({self.name}, {len(self.args)})'
 
-@dataclass
+@dataclass(slots = True)
 class STORE_GLOBAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'STORE_GLOBAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class STORE_LOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'STORE_LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class PRINT(INSTRUCTION):
     def __str__(self):
         return 'PRINT'
 
-@dataclass
+@dataclass(slots = True)
+class CPRINT(INSTRUCTION): # Characters are stored as their int code, and only differ when printed
+    def __str__(self):
+        return 'CPRINT'
+
+@dataclass(slots = True)
 class LOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class RETURN(INSTRUCTION):
     def __str__(self):
         return 'RETURN'
 
-@dataclass
+@dataclass(slots = True)
 class FPUSH(INSTRUCTION):
     value : int
     def __str__(self):
         return f'PUSH({self.value})'
     
-@dataclass
+@dataclass(slots = True)
 class FARITHMETIC(INSTRUCTION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FRELATION(INSTRUCTION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FADD(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class FMINUS(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class FMULT(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
 class FDIVIDE(ARITHMETIC): pass
 
-@dataclass
+@dataclass(slots = True)
+class FNEG(INSTRUCTION): pass
+
+@dataclass(slots = True)
 class FLT(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FLE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FGT(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FGE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FEQ(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FNE(RELATION): pass
 
-@dataclass
+@dataclass(slots = True)
 class FLOAD_GLOBAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOAD_GLOBAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class FLOAD_LOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOAD_LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class FSTORE_GLOBAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'STORE_GLOBAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class FSTORE_LOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'STORE_LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class FPRINT(INSTRUCTION):
     def __str__(self):
         return 'PRINT'
 
-@dataclass
+@dataclass(slots = True)
 class FLOCAL(INSTRUCTION):
     name : str
     def __str__(self):
         return f'LOCAL({self.name})'
 
-@dataclass
+@dataclass(slots = True)
 class FRETURN(INSTRUCTION):
     def __str__(self):
         return 'RETURN'
 
-@dataclass
+@dataclass(slots = True)
 class GOTO(INSTRUCTION):
     destination : 'BLOCK'
     def __str__(self):
         return f'GOTO({self.destination.label})'
 
-@dataclass
+@dataclass(slots = True)
 class CBRANCH(INSTRUCTION):
     true_block : 'BLOCK'
     false_block : 'BLOCK'
@@ -205,7 +219,7 @@ class CBRANCH(INSTRUCTION):
         return f'CBRANCH({self.true_block.label}, {self.false_block.label})'
 
 # Model extensions:
-@dataclass
+@dataclass(slots = True)
 class EXPR(Expression):
     instructions : list[INSTRUCTION]
     def __init__(self, instructions):
@@ -214,19 +228,13 @@ class EXPR(Expression):
     def __str__(self):
         return f'[{", ".join([str(ins) for ins in self.instructions])}]'
     
-@dataclass
+@dataclass(slots = True)
 class STATEMENT(Statement):
     instructions : list[INSTRUCTION]
     def __str__(self):
         return f'[{", ".join([str(ins) for ins in self.instructions])}]'
     
-@dataclass
+@dataclass(slots = True)
 class BLOCK(Statement):
     label : str
     instructions : list[INSTRUCTION]
-
-@dataclass
-class LLVM(INSTRUCTION):
-    op : str
-    def __str__(self):
-        return f'LLVM({self.op})'
\ No newline at end of file
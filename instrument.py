@@ -0,0 +1,163 @@
+# instrument.py
+
+from model import *
+from instructionsmodel import INSTRUCTION, BLOCK
+from passes import Pass
+from dataclasses import fields
+from typing import Callable
+import json
+import sys
+import time
+import tracemalloc
+
+# Opt-in measurements of the compiler itself. The PassManager is given an Instrumentation, and
+# then records every step it runs:
+#   name          the pass, or 'a + b + c' for traversal passes fused into one walk
+#   scope         'program', or the function for the backend, which runs a function at a time
+#   start         seconds since the Instrumentation was made
+#   seconds       wall time of the step
+#   peak_bytes    the most memory allocated during the step, above what was allocated before it
+#   nodes, instructions, blocks   the size of the IR the step produced
+#   hooks         for fused passes, the time each pass spent in its own hooks (the rest of the
+#                 step's time is the walk itself)
+# The records can be written as JSON, or as Chrome trace events for chrome://tracing or
+# Perfetto. Without an Instrumentation nothing is measured, formatted or printed.
+#
+# Memory is measured with tracemalloc, which makes everything several times slower. With
+# memory = False it is left off, and times are closer to those of an uninstrumented build.
+
+def ir_size(program : Program) -> dict:
+    nodes = instructions = blocks = 0
+    stack = [program]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        if isinstance(node, BLOCK):
+            blocks += 1
+        for f in fields(node):
+            value = getattr(node, f.name)
+            if isinstance(value, ASTNode):
+                stack.append(value)
+            elif isinstance(value, list):
+                for v in value:
+                    if isinstance(v, ASTNode):
+                        stack.append(v)
+                    elif isinstance(v, (INSTRUCTION, str)): # str for LLVM lines, after llvm_make
+                        instructions += 1
+    return {'nodes' : nodes, 'instructions' : instructions, 'blocks' : blocks}
+
+# Runs the hooks of another pass, adding up the time they take
+class TimedPass(Pass):
+    def __init__(self, inner : Pass):
+        self.inner = inner
+        self.seconds = 0.0
+
+    def expression(self, e : Expression) -> Expression:
+        start = time.perf_counter()
+        e = self.inner.expression(e)
+        self.seconds += time.perf_counter() - start
+        return e
+
+    def statement(self, s : Statement) -> list[Statement]:
+        start = time.perf_counter()
+        out = self.inner.statement(s)
+        self.seconds += time.perf_counter() - start
+        return out
+
+    def enter_block(self, owner : ASTNode):
+        start = time.perf_counter()
+        self.inner.enter_block(owner)
+        self.seconds += time.perf_counter() - start
+
+    def exit_block(self, owner : ASTNode, statements : list[Statement]) -> list[Statement]:
+        start = time.perf_counter()
+        out = self.inner.exit_block(owner, statements)
+        self.seconds += time.perf_counter() - start
+        return out
+
+class Instrumentation:
+    def __init__(self, memory : bool = True):
+        self.memory = memory
+        self.records = []
+        self.origin = time.perf_counter()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Runs fn(argument), which gives a Program, as one step and records it
+    def measure(self, name : str, fn : Callable[..., Program], argument,
+                scope : str = 'program', **extra) -> Program:
+        if self.memory:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        program = fn(argument)
+        seconds = time.perf_counter() - start
+        record = {'name' : name, 'scope' : scope, 'start' : start - self.origin, 'seconds' : seconds}
+        if self.memory:
+            record['peak_bytes'] = max(0, tracemalloc.get_traced_memory()[1] - before)
+        record.update(ir_size(program))
+        record.update(extra)
+        self.records.append(record)
+        return program
+
+    def stop(self):
+        if self.memory:
+            tracemalloc.stop()
+
+    # Per step name: the number of steps, and their total time and largest peak. Each of the fused
+    # passes also gets a total of its own, from its hook times.
+    def totals(self) -> dict:
+        totals = {}
+        def add(name, seconds, peak_bytes):
+            total = totals.setdefault(name, {'steps' : 0, 'seconds' : 0.0, 'peak_bytes' : 0})
+            total['steps'] += 1
+            total['seconds'] += seconds
+            total['peak_bytes'] = max(total['peak_bytes'], peak_bytes)
+        for r in self.records:
+            add(r['name'], r['seconds'], r.get('peak_bytes', 0))
+            for name, seconds in r.get('hooks', {}).items():
+                add(name, seconds, 0)
+        return totals
+
+    def to_json(self) -> str:
+        return json.dumps({'steps' : self.records, 'totals' : self.totals()}, indent = 2)
+
+    # Each step is a complete ('X') event, with the IR size as a counter ('C') after it. The hook
+    # times of fused passes are shown as slices inside their step, one after another, although
+    # the hooks really run interleaved, node by node.
+    def to_chrome_trace(self) -> str:
+        events = []
+        for r in self.records:
+            ts = r['start'] * 1e6
+            args = {k : v for k, v in r.items() if k not in ('name', 'start', 'seconds', 'hooks')}
+            events.append({'name' : r['name'], 'cat' : r['scope'], 'ph' : 'X', 'ts' : ts,
+                           'dur' : r['seconds'] * 1e6, 'pid' : 0, 'tid' : 0, 'args' : args})
+            for name, seconds in r.get('hooks', {}).items():
+                events.append({'name' : name, 'cat' : r['scope'], 'ph' : 'X', 'ts' : ts,
+                               'dur' : seconds * 1e6, 'pid' : 0, 'tid' : 0, 'args' : {'hook seconds' : seconds}})
+                ts += seconds * 1e6
+            events.append({'name' : 'IR size', 'ph' : 'C', 'ts' : (r['start'] + r['seconds']) * 1e6,
+                           'pid' : 0, 'tid' : 0,
+                           'args' : {k : r[k] for k in ('nodes', 'instructions', 'blocks')}})
+        return json.dumps({'traceEvents' : events, 'displayTimeUnit' : 'ms'})
+
+    def report(self) -> str:
+        lines = [f'{"pass":<40} {"steps":>5} {"seconds":>9} {"peak KiB":>9}']
+        totals = sorted(self.totals().items(), key = lambda item: item[1]['seconds'], reverse = True)
+        for name, total in totals:
+            lines.append(f'{name[:40]:<40} {total["steps"]:>5} {total["seconds"]:>9.4f} {total["peak_bytes"] / 1024:>9.1f}')
+        return '\n'.join(lines)
+
+# Prints where the time goes when compiling a program to LLVM, at the level given
+def main():
+    from main import file_to_AST
+    from backend import compile_module
+    instrumentation = Instrumentation()
+    program = instrumentation.measure('parse', file_to_AST, sys.argv[1])
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    compile_module(program, level = level, instrumentation = instrumentation)
+    instrumentation.stop()
+    print(instrumentation.report())
+
+if __name__ == '__main__':
+    main()
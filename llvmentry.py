@@ -10,14 +10,9 @@ def create_entry_blocks(program : Program) -> Program:
             new_statements.append(s)
     return Program(new_statements)
 
+# LLVM doesn't allow branches back to the first block of a function, which may be a loop
+# header, so every function starts with an entry block that jumps to it. Parameters are used
+# directly as SSA values, so there is nothing else to do here.
 def add_entry_to_function(function : FunctionDefinition) -> FunctionDefinition:
-    entry_block_ins = []
-    new_params = []
-    for param in function.parameters.data:
-        name = param.string
-        new_params.append(Identifier("", f'.arg_{name}'))
-        entry_block_ins.append(LLVM(f'%{name} = alloca i32'))
-        entry_block_ins.append(LLVM(f'store i32 %.arg_{name}, i32* %{name}'))
-
-    entry_block_ins.append(LLVM(f'br label %{function.body[0].label}'))
-    return FunctionDefinition(function.name, Parameters("", new_params), [BLOCK('entry', entry_block_ins)] + function.body)
+    entry_block_ins = [f'br label %{function.body[0].label}']
+    return FunctionDefinition(function.name, function.parameters, [BLOCK('entry', entry_block_ins)] + function.body)
@@ -1,23 +1,33 @@
 # llvmformat.py
 
 from instructionsmodel import *
+from LLVMgen import llvm_type, zeros, function_symbol, global_symbol, parameter_register
 indent = '    '
 
+header = 'declare i32 @_print_int(i32)\ndeclare i32 @_print_float(double)\ndeclare i32 @_print_char(i32)\n'
+
 def llvm_format(program : Program) -> str:
-    lines = ['declare i32 @_print_int(i32)\n']
+    lines = [header]
     for s in program.statements:
         match s:
-            case FunctionDefinition(name, parameters, body):
-                definitions = f'define i32 @{name.string}('
-                params_str = [f'i32 %{p.string}' for p in parameters.data]
-                definitions += ", ".join(params_str) + ") {"
-                lines.append(definitions)
-                for block in body:
-                    lines.append(f'{block.label}:')
-                    for llvm_op in block.instructions:
-                        lines.append(indent + llvm_op.op)
-                lines.append('}\n')
-            case GlobalVarDec(name):
-                string = name.string
-                lines.append(f'@{string} = global i32 0')
-    return '\n'.join(lines)
\ No newline at end of file
+            case FunctionDefinition():
+                lines.append(format_function(s))
+            case GlobalVarDec():
+                lines.append(format_global(s))
+    return '\n'.join(lines)
+
+def format_function(function : FunctionDefinition) -> str:
+    definitions = f'define {llvm_type(function.name.wtype)} {function_symbol(function.name.string)}('
+    params_str = [f'{llvm_type(p.wtype)} {parameter_register(p.string)}' for p in function.parameters.data]
+    definitions += ", ".join(params_str) + ") {"
+    lines = [definitions]
+    for block in function.body:
+        lines.append(f'{block.label}:')
+        for llvm_op in block.instructions:
+            lines.append(indent + llvm_op)
+    lines.append('}\n')
+    return '\n'.join(lines)
+
+def format_global(declaration : GlobalVarDec) -> str:
+    type = llvm_type(declaration.name.wtype)
+    return f'{global_symbol(declaration.name.string)} = global {type} {zeros[type]}'
@@ -0,0 +1,139 @@
+# loopinvariants.py
+
+from model import *
+from passes import Pass, rebuild, child_fields, EXPRESSION, EXPRESSION_LIST
+from formatter import format_expression
+from inline import called_functions, global_writes
+
+# Loop-invariant code motion. Runs after front_end's other passes, on resolved identifiers.
+# An expression inside a while loop (its test included) is invariant when it contains no calls
+# and reads only constants, locals that the loop never declares or assigns, and globals that
+# neither the loop nor any function it may call assigns. The largest such expressions are
+# computed once, before the loop, into new locals:
+#     local f.loop0; local[f.loop0] = global[xmax] - global[xmin];
+#     while local[x] < local[f.loop0] { ... }
+# Hoisted expressions are evaluated even when the loop doesn't run, or when they were inside an
+# If that isn't taken, so only expressions that can't fail are hoisted: division, integer or
+# float, only by a non-zero constant. Constants and plain locals are left where they are.
+#
+# The walk is bottom-up, so inner loops are done first and whatever they hoisted is then
+# considered again by the loop around them. Nested loops are otherwise skipped, since anything
+# left in them depends on a variable they assign, which the outer loop assigns too.
+
+class HoistInvariants(Pass):
+    def __init__(self):
+        self.writes = {} # function name -> globals it, or anything it calls, may assign
+        self.function = None
+        self.count = 0 # temporaries made in this function
+        self.hoisted = 0 # expressions hoisted in the whole program
+
+    def enter_block(self, owner : ASTNode):
+        match owner:
+            case Program(statements):
+                functions = {s.name.string : s for s in statements if isinstance(s, FunctionDefinition)}
+                calls = {name : called_functions(f.body) for name, f in functions.items()}
+                self.writes = global_writes(functions, calls)
+            case FunctionDefinition(name):
+                self.function = name.string
+                self.count = 0
+
+    def statement(self, s : Statement) -> list[Statement]:
+        if not isinstance(s, While):
+            return [s]
+        loop = LoopMotion(self, s)
+        new_s = loop.rewrite(s)
+        return loop.preheader + [new_s]
+
+    def temporary(self) -> str:
+        name = f'{self.function}.loop{self.count}'
+        self.count += 1
+        return name
+
+class LoopMotion:
+    def __init__(self, hoister : HoistInvariants, loop : While):
+        self.hoister = hoister
+        self.locals = set() # locals declared or assigned in the loop
+        self.globals = set() # globals that may change while the loop runs
+        self.all_globals = False # set when the loop calls a function we know nothing about
+        self.temporaries = {} # (type, expression) -> local holding it
+        self.preheader = []
+        collect_writes(loop.body, self.locals, self.globals)
+        for name in called_functions([loop]):
+            if name in hoister.writes:
+                self.globals |= hoister.writes[name]
+            else:
+                self.all_globals = True
+
+    def invariant(self, e : Expression) -> bool:
+        match e:
+            case Integer() | Float() | Character():
+                return True
+            case LocalId(name):
+                return name not in self.locals
+            case GlobalId(name):
+                return not self.all_globals and name not in self.globals
+            case BinaryOp('/', left, right):
+                return isinstance(right, (Integer, Float)) and right.n != 0 and self.invariant(left)
+            case BinaryOp(_, left, right):
+                return self.invariant(left) and self.invariant(right)
+            case UnaryOp(_, exp):
+                return self.invariant(exp)
+            case _:
+                return False
+
+    def hoist(self, e : Expression) -> Expression:
+        if isinstance(e, (BinaryOp, UnaryOp, GlobalId)) and self.invariant(e):
+            key = (e.wtype, format_expression(e))
+            if key not in self.temporaries:
+                name = self.hoister.temporary()
+                self.temporaries[key] = LocalId(e.wtype, name)
+                self.preheader += [LocalVarDec(Identifier(e.wtype, name)), Assignment(LocalId(e.wtype, name), e)]
+                self.hoister.hoisted += 1
+            return self.temporaries[key]
+        changes = {}
+        for name, kind in child_fields(type(e)):
+            value = getattr(e, name)
+            if kind == EXPRESSION:
+                new_value = self.hoist(value)
+            else:
+                new_value = [self.hoist(v) for v in value]
+                if all(new is old for new, old in zip(new_value, value)):
+                    new_value = value
+            if new_value is not value:
+                changes[name] = new_value
+        return rebuild(e, changes) if changes else e
+
+    # s with the invariant expressions in it replaced. The While being hoisted from is rewritten
+    # completely, nested loops are left alone.
+    def rewrite(self, s : Statement, top : bool = True) -> Statement:
+        if isinstance(s, While) and not top:
+            return s
+        changes = {}
+        for name, kind in child_fields(type(s)):
+            value = getattr(s, name)
+            if kind == EXPRESSION:
+                new_value = self.hoist(value)
+            elif kind == EXPRESSION_LIST:
+                new_value = [self.hoist(v) for v in value]
+                if all(new is old for new, old in zip(new_value, value)):
+                    new_value = value
+            else:
+                new_value = [self.rewrite(child, False) for child in value]
+                if all(new is old for new, old in zip(new_value, value)):
+                    new_value = value
+            if new_value is not value:
+                changes[name] = new_value
+        return rebuild(s, changes) if changes else s
+
+def collect_writes(statements : list[Statement], local_names : set, global_names : set):
+    for s in statements:
+        match s:
+            case LocalVarDec(name) | Assignment(LocalId() as name):
+                local_names.add(name.string)
+            case Assignment(GlobalId(name)):
+                global_names.add(name)
+            case If(_, consequence, alternative):
+                collect_writes(consequence, local_names, global_names)
+                collect_writes(alternative, local_names, global_names)
+            case While(_, body) | InlinedBody(_, _, body):
+                collect_writes(body, local_names, global_names)
@@ -1,17 +1,29 @@
 from model import *
 from formatter import format_program
-from foldconstants import fold_constants # type: ignore
-from deinit import deinit_variables # type: ignore
-from resolve import resolve_scopes # type: ignore
-from unscript import unscript_toplevel # type: ignore
-from addreturn import add_return # type: ignore
+from passes import run_passes
+from foldconstants import FoldConstants, PropagateConstants # type: ignore
+from deinit import DeinitVariables # type: ignore
+from resolve import ResolveScopes # type: ignore
+from unscript import UnscriptToplevel # type: ignore
+from addreturn import AddReturn # type: ignore
+from shortcircuit import LowerShortCircuit
+from inline import Inliner
+from tailcalls import eliminate_tail_calls
+from loopinvariants import HoistInvariants
+from simplifyalgebra import SimplifyAlgebra, float_rules
+from passmanager import PassInfo, PassManager, default_level
+from instrument import Instrumentation
 from parser import *
 from createblocks import create_blocks
 from controlflow import add_control_flow
+from simplifycfg import simplify_cfg
+from valuenumbering import eliminate_common_subexpressions
 from createinstructions import exps_stmts_to_instr
 from LLVMgen import llvm_make
 from llvmentry import create_entry_blocks
-from llvmformat import llvm_format
+from llvmformat import llvm_format, format_function
+from dataclasses import fields, make_dataclass
+import tracemalloc
 
 def init_programs():
     programs = []
@@ -73,23 +85,85 @@ def print_programs(programs : list[Program]):
         print(f'Program {i + 1}:')
         print(format_program(programs[i]))
 
-def compile(program : Program) -> Program:
-    print(format_program(program))
-    program = fold_constants(program)
-    print(format_program(program))
-    program = deinit_variables(program)
-    program = resolve_scopes(program)
-    program = unscript_toplevel(program)
-    program = add_return(program)
-    print(program)
-    print(format_program(program))
-    program = exps_stmts_to_instr(program)
-    program = create_blocks(program)
-    program = add_control_flow(program)
-    print(format_program(program))
-    program = llvm_make(program)
-    program = create_entry_blocks(program)
-    return program
+def lower_short_circuit(program : Program) -> Program:
+    return run_passes(program, [LowerShortCircuit()])
+
+# The passes of front_end, in order, for the PassManager. A simplifier that is given is used
+# for every algebra rule it has, instead of the two simplifiers.
+def front_end_passes(inliner : Inliner | None = None, simplifier : SimplifyAlgebra | None = None) -> list[PassInfo]:
+    if simplifier is not None:
+        simplify = [PassInfo('simplify algebra', 2, make = lambda: simplifier)]
+    else:
+        simplify = [PassInfo('simplify algebra', 2, make = SimplifyAlgebra),
+                    PassInfo('simplify float algebra', 2, make = lambda: SimplifyAlgebra(float_rules),
+                             requires = ('features',), applies = lambda features: 'floats' in features)]
+    return [
+        # The semantic passes all run together, in this order, in a single traversal
+        PassInfo('fold constants', 1, make = FoldConstants),
+        PassInfo('deinit variables', 0, make = DeinitVariables),
+        PassInfo('resolve scopes', 0, make = ResolveScopes),
+        PassInfo('unscript toplevel', 0, make = UnscriptToplevel, invalidates = ('call graph',)),
+        PassInfo('add return', 0, make = AddReturn),
+        # Separately, as the locals it declares would be looked up again by ResolveScopes
+        PassInfo('lower short circuit', 0, run = lower_short_circuit,
+                 requires = ('features',), applies = lambda features: 'logic' in features),
+        # Before inlining, so that functions whose recursion was removed can then be inlined
+        PassInfo('eliminate tail calls', 2, run = eliminate_tail_calls, requires = ('call graph',),
+                 invalidates = ('features', 'call graph'),
+                 applies = lambda calls: any(name in callees for name, callees in calls.items())),
+        PassInfo('inline', 2, run = (inliner or Inliner()).run, requires = ('call graph',),
+                 invalidates = ('call graph',),
+                 applies = lambda calls: any(callees - {name} for name, callees in calls.items())),
+        # Propagating constants needs resolved identifiers and the finished main, so it runs after,
+        # and also sees the arguments of inlined calls. Expressions are simplified once folded, and
+        # loops are then given their simplified bodies.
+        PassInfo('propagate constants', 1, make = PropagateConstants),
+        *simplify,
+        PassInfo('hoist invariants', 2, make = HoistInvariants,
+                 requires = ('features',), applies = lambda features: 'loops' in features),
+    ]
+
+# The passes from the output of front_end down to linked basic blocks
+def back_end_passes() -> list[PassInfo]:
+    return [
+        PassInfo('create instructions', 0, run = exps_stmts_to_instr),
+        PassInfo('create blocks', 0, run = create_blocks),
+        PassInfo('add control flow', 0, run = add_control_flow),
+        PassInfo('simplify cfg', 1, run = simplify_cfg),
+        PassInfo('eliminate common subexpressions', 2, run = eliminate_common_subexpressions),
+    ]
+
+# The passes from linked basic blocks to LLVM
+def llvm_passes() -> list[PassInfo]:
+    return [
+        PassInfo('llvm make', 0, run = llvm_make),
+        PassInfo('create entry blocks', 0, run = create_entry_blocks),
+    ]
+
+# Resolves the AST into global declarations and independent functions (including main)
+def front_end(program : Program, inliner : Inliner | None = None,
+              simplifier : SimplifyAlgebra | None = None, level : int = default_level,
+              instrumentation : Instrumentation | None = None) -> Program:
+    return PassManager(front_end_passes(inliner, simplifier), level, instrumentation).run(program)
+
+# Lowers the AST down to linked basic blocks, which is shared by the LLVM backend and the VM
+def lower_program(program : Program, level : int = default_level,
+                  instrumentation : Instrumentation | None = None) -> Program:
+    program = front_end(program, level = level, instrumentation = instrumentation)
+    return PassManager(back_end_passes(), level, instrumentation).run(program)
+
+def compile(program : Program, level : int = default_level,
+            instrumentation : Instrumentation | None = None) -> Program:
+    program = lower_program(program, level, instrumentation)
+    return PassManager(llvm_passes(), level, instrumentation).run(program)
+
+# Runs the backend on a single function from the output of front_end. Labels and registers
+# are numbered per function, so the result doesn't depend on the rest of the program.
+def function_to_llvm(function : FunctionDefinition, level : int = default_level,
+                     instrumentation : Instrumentation | None = None) -> str:
+    passes = back_end_passes() + llvm_passes()
+    program = PassManager(passes, level, instrumentation, function.name.string).run(Program([function]))
+    return format_function(program.statements[0])
 
 def project2(programs : list[Program]) -> list[Program]:
     for i in range(len(programs)):
@@ -97,32 +171,131 @@ def project2(programs : list[Program]) -> list[Program]:
         print(format_program(compile(programs[i])))
 
 def file_to_AST(filename : str) -> Program:
-    with open(filename, 'r') as file:
-        src = file.read()
-    tokens = tokenize(src)
-    program = parse_tokens(tokens)
-    return program
+    return parse_tokens(iter_file_tokens(filename))
 
-def parse_tokens(tokens : list[Token]) -> Program:
+def parse_tokens(tokens : Iterable[Token]) -> Program:
     return Program(Parser(tokens).parse_statements())
 
+def iter_nodes(node : ASTNode):
+    # Generic attribute-based traversal, as described at the top of model.py
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        for f in fields(node):
+            value = getattr(node, f.name)
+            if isinstance(value, ASTNode):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(v for v in value if isinstance(v, ASTNode))
+
+def copy_tree(node : ASTNode, classes : dict):
+    # Rebuilds a tree with each node class swapped for classes[type], sharing literals
+    values = {}
+    for f in fields(node):
+        value = getattr(node, f.name)
+        if isinstance(value, ASTNode):
+            value = copy_tree(value, classes)
+        elif isinstance(value, list):
+            value = [copy_tree(v, classes) if isinstance(v, ASTNode) else v for v in value]
+        values[f.name] = value
+    new_node = object.__new__(classes[type(node)])
+    for name, value in values.items():
+        object.__setattr__(new_node, name, value)
+    return new_node
+
+def bench_ast_memory(copies = 200):
+    # Compares the slotted node classes against plain @dataclass nodes with a __dict__,
+    # which is how model.py used to represent them
+    with open('tests/mandel.wb', 'r') as file:
+        src = file.read() * copies
+    program = parse_tokens(tokenize(src))
+    n_nodes = sum(1 for _ in iter_nodes(program))
+    node_classes = {type(n) for n in iter_nodes(program)}
+    slotted = {cls : cls for cls in node_classes}
+    unslotted = {cls : make_dataclass(cls.__name__, [(f.name, f.type) for f in fields(cls)])
+                 for cls in node_classes}
+    for label, classes in [('__dict__ nodes', unslotted), ('slotted nodes', slotted)]:
+        tracemalloc.start()
+        tree = copy_tree(program, classes)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tree
+        print(f'{label}: {n_nodes} nodes, {size / n_nodes:.1f} bytes/node')
+
 def main():
     #programs = init_programs()
     #tests(programs)
     tests([])
+    test_levels(['shortcircuit.wb', 'guardeddivision.wb'])
+    test_native(['sqrt.wb', 'floats.wb', 'char.wb', 'guardeddivision.wb', 'unicode.wb'])
     #print_programs(programs)
     #project2(programs)
 
 def tests(programs : list[Program]):
+    from batch import run_batch
+    import tempfile
     tests = ['program1.wb', 'program2.wb', 'program3.wb', 'program4.wb', 'fact.wb', 'factre.wb', 'unary.wb']
-    for i in range(len(tests)):
-        ast = file_to_AST(f'tests/wabbi/{tests[i]}')
-        print(f"Testing {tests[i]}: ==========================================================================")
-        #if i < 4:
-            #assert programs[i] == ast, ast
-        #print(format_program(compile(ast)))
-        print(llvm_format(compile(ast)))
-        print(f"Finished Testing {tests[i]}: ==========================================================================")
+    with tempfile.TemporaryDirectory() as out_dir:
+        results = run_batch([f'tests/wabbi/{name}' for name in tests], out_dir)
+        for name, result in zip(tests, results):
+            print(f"Testing {name}: ==========================================================================")
+            if result['status'] == 'ok':
+                with open(result['output']) as file:
+                    print(file.read())
+            else:
+                print(f"Failed in {result['stage']}: {result['error']}")
+            print(f"Finished Testing {name}: ==========================================================================")
+
+# Runs each program in the VM at every optimization level, which should all print the same as -O0
+def test_levels(tests : list[str]):
+    from passmanager import levels
+    from vm import run_program
+    import io
+    for name in tests:
+        outputs = []
+        for level in levels:
+            out = io.StringIO()
+            try:
+                run_program(lower_program(file_to_AST(f'tests/{name}'), level), out)
+            except RuntimeError as e:
+                out.write(f'RuntimeError: {e}\n')
+            outputs.append(out.getvalue())
+        differing = [f'-O{level}' for level, output in zip(levels, outputs) if output != outputs[0]]
+        print(f"Testing {name} at every level: {'differs at ' + ', '.join(differing) if differing else 'ok'}")
+
+# Builds each program with clang at every level, and checks that the executables print the same
+# as the VM. clang optimizes too, so this also catches IR that LLVM understands differently.
+def test_native(tests : list[str], clang : str = 'clang'):
+    from batch import run_batch
+    from driver import Toolchain, ClangNotFound
+    from passmanager import levels
+    from vm import run_program
+    import io
+    import os
+    import subprocess
+    import tempfile
+    expected = []
+    for name in tests:
+        out = io.StringIO()
+        run_program(lower_program(file_to_AST(f'tests/{name}')), out)
+        expected.append(out.getvalue())
+    differing = {name : [] for name in tests}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for level in levels:
+            try:
+                results = run_batch([f'tests/{name}' for name in tests], os.path.join(out_dir, f'O{level}'),
+                                    Toolchain(clang, level), level = level)
+            except ClangNotFound as e:
+                print(f'Skipping the native tests, {e}')
+                return
+            for name, result, output in zip(tests, results, expected):
+                if result['status'] != 'ok':
+                    differing[name].append(f"-O{level} (failed in {result['stage']}: {result['error'].strip()})")
+                elif subprocess.run([result['output']], capture_output = True, text = True).stdout != output:
+                    differing[name].append(f'-O{level}')
+    for name in tests:
+        print(f"Testing {name} natively: {'differs at ' + ', '.join(differing[name]) if differing[name] else 'ok'}")
 
 if __name__ == '__main__':
     main()
@@ -4,46 +4,53 @@ from enum import Enum
 # Everything EXCEPT for literal information and types will inherit from ASTNode
 # Then to traverse the tree, we take the class attributes which are 
 # 1. Literals (e.g. int, string) 2. ASTNodes 3. Lists (of ASTNodes)
-class ASTNode: pass
-class Statement(ASTNode): pass # Statements perform some operation, but do not evaluate to anything
-
-@dataclass
+# Every node class is slotted (no per-instance __dict__), which keeps large trees small.
+# Subclasses must keep using @dataclass(slots = True), or they get a __dict__ back.
+class ASTNode:
+    __slots__ = ()
+class Statement(ASTNode): # Statements perform some operation, but do not evaluate to anything
+    __slots__ = ()
+
+@dataclass(slots = True)
 class Expression(ASTNode): # Expressions MUST evaluate to some value
     wtype : str
 
 # Top level program class
-@dataclass
+@dataclass(slots = True)
 class Program(ASTNode):
     statements : list[Statement]
 
 # Expressions
-@dataclass
+@dataclass(slots = True)
 class Integer(Expression): 
     wtype : str = "int"
     n : int = 0
     __match_args__ = ('n',)
-    def __init__(self, n):
+    def __init__(self, n = 0):
+        self.wtype = 'int'
         self.n = n
 
-@dataclass
+@dataclass(slots = True)
 class Float(Expression): 
     wtype : str = "float"
     n : float = 0.0
     __match_args__ = ('n',)
-    def __init__(self, n):
+    def __init__(self, n = 0.0):
+        self.wtype = 'float'
         self.n = n
 
-@dataclass
+@dataclass(slots = True)
 class Character(Expression): 
     wtype : str = "char"
     c : str = ' '
     __match_args__ = ('c',)
-    def __init__(self, c):
+    def __init__(self, c = ' '):
+        self.wtype = 'char'
         self.c = c
 
 # Identifiers:
 # Identifiers (vars & functions) -> Identifiers (funcs) & Global/LocalId (Vars)
-@dataclass
+@dataclass(slots = True)
 class Identifier(Expression):
     string : str
     __match_args__ = ('string',)
@@ -54,88 +61,109 @@ class Identifier(Expression):
     def __str__(self):
         return self.string
 
-@dataclass
+@dataclass(slots = True)
 class GlobalId(Identifier):
     __match_args__ = Identifier.__match_args__
 
-@dataclass
+@dataclass(slots = True)
 class LocalId(Identifier):
     __match_args__ = Identifier.__match_args__
 
-@dataclass
+@dataclass(slots = True)
 class BinaryOp(Expression):
     op : str
     left : Expression
     right : Expression
     __match_args__ = ('op', 'left', 'right')
 
-@dataclass
+@dataclass(slots = True)
 class UnaryOp(Expression):
     op : str
     exp : Expression
     __match_args__ = ('op', 'exp')
 
+# and/or: right is only evaluated when left doesn't already decide the result, which is 1 or 0
+@dataclass(slots = True)
+class LogicalOp(Expression):
+    op : str
+    left : Expression
+    right : Expression
+    __match_args__ = ('op', 'left', 'right')
+
 # Should parameters be a separate object
 # or should it just exist within the function object?
 # if we want to deal with type declarations later, how do we do that?
-@dataclass
+@dataclass(slots = True)
 class Parameters(Expression): 
     data : list[Identifier]
     __match_args__ = ('data',)
 
-@dataclass 
+@dataclass(slots = True)
 class FunctionCall(Expression):
     name : Identifier
     arguments : list[Expression]
     __match_args__ = ('name', 'arguments')
 
-@dataclass
+@dataclass(slots = True)
 class Print(Statement):
     value : Expression
 
-@dataclass
+@dataclass(slots = True)
 class ExprStatement(Statement):
     exp : Expression
 
 # Variable Declarations
 # AST Transformation: Variable -> Variable Decl -> Local/Global resolution
-@dataclass
+@dataclass(slots = True)
 class Variable(Statement): 
     name : Identifier
     value : Expression
 
-@dataclass
+@dataclass(slots = True)
 class VariableDeclaration(Statement):
     name : Identifier
 
-@dataclass
+@dataclass(slots = True)
 class GlobalVarDec(VariableDeclaration): pass
 
-@dataclass
+@dataclass(slots = True)
 class LocalVarDec(VariableDeclaration): pass
 
-@dataclass
+@dataclass(slots = True)
 class Assignment(Statement):
     name : Identifier
     value : Expression
 
-@dataclass
+@dataclass(slots = True)
 class If(Statement):
     test : Expression 
     consequence : list[Statement]
     alternative : list[Statement]
 
-@dataclass
+@dataclass(slots = True)
 class While(Statement):
     test : Expression
     body : list[Statement]
 
-@dataclass
+@dataclass(slots = True)
 class FunctionDefinition(Statement):
     name : Identifier
     parameters : Parameters
     body : list[Statement]
 
-@dataclass
+@dataclass(slots = True)
 class Return(Statement):
-    value : Expression = field(default_factory = Integer)
\ No newline at end of file
+    value : Expression = field(default_factory = Integer)
+# Inlining: the body of an inlined call to function name. Its Returns have been replaced by an
+# assignment to the call's result followed by a LeaveInlined, which jumps to just after the
+# InlinedBody with the same label. Labels are unique within a function, since inlined bodies
+# can be nested.
+@dataclass(slots = True)
+class InlinedBody(Statement):
+    name : Identifier
+    label : str
+    body : list[Statement]
+
+@dataclass(slots = True)
+class LeaveInlined(Statement):
+    label : str
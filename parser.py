@@ -2,18 +2,25 @@
 
 from tokenizer import * #type: ignore
 from model import *
+from collections import deque
+from typing import Iterable
+import random
+import time
 
 class Parser:
-    def __init__(self, tokens : list[Token]):
-        self.tokens = tokens
-        self.n = 0
+    # tokens may be a list or a lazy stream such as iter_file_tokens; only the lookahead
+    # window of tokens that have been peeked but not yet consumed is kept around
+    def __init__(self, tokens : Iterable[Token]):
+        self.tokens = iter(tokens)
+        self.window = deque()
+        self.eof = Token('EOF', '')
 
     def expect(self, token_type : str) -> Token: # Where token_type is one of the valid types in the grammar
-        token = self.tokens[self.n]
+        token = self.peek()
         if token.token_type == 'EOF':
             raise SyntaxError(f'Expected {token_type} but reached EOF')
         elif token.token_type == token_type:
-            self.n += 1
+            self.window.popleft()
             return token
         else:
             raise SyntaxError(f'Expected {token_type} at {token}')
@@ -106,12 +113,15 @@ class Parser:
         return ExprStatement(exp)
 
     def peek(self) -> Token:
-        return self.tokens[self.n]
+        if self.window:
+            return self.window[0]
+        return self.peek_k(1)
 
     def peek_k(self, k : int) -> Token: # peeks k tokens ahead
-        if self.n + (k - 1) < len(self.tokens):
-            return self.tokens[self.n + (k - 1)]
-        return Token('EOF', "")
+        window = self.window
+        while len(window) < k:
+            window.append(next(self.tokens, self.eof))
+        return window[k - 1]
 
     def parse_statement(self) -> Statement:
         # LL(1):
@@ -143,57 +153,107 @@ class Parser:
             statements.append(self.parse_statement())
         return statements
     
-    def parse_func_args(self, name) -> FunctionCall:
-        self.expect('LPAREN')
-        if self.peek().token_type == 'RPAREN': # No arguments
-            self.expect('RPAREN')
-            return FunctionCall("", name, [])
-        
-        arguments = [self.parse_expression()] 
-        while self.peek().token_type == 'COMMA':
-            self.expect('COMMA')
-            arguments.append(self.parse_expression())
-        self.expect('RPAREN')
-        return FunctionCall("", name, arguments)
-    
+    # Precedence climbing over an explicit operator stack, so that neither long chains of
+    # operators nor deeply nested parentheses, unary minus or calls use the Python stack.
+    # The operator stack holds binary operators, unary minus, and open parentheses/calls.
+    # Every operand or operator is shifted once and reduced once, so parsing is linear.
+    def parse_expression(self) -> Expression:
+        operands = []
+        operators = [] # (kind, value, precedence); groups have precedence 0 so they stop reductions
+        open_groups = 0 # number of '(' and calls on the operator stack
+        while True:
+            # Expecting an operand, possibly preceded by prefix operators
+            token = self.peek()
+            match token.token_type:
+                case 'MINUS': # if we are here, it must be a unary op
+                    self.expect('MINUS')
+                    operators.append(('unary', '-', unary_precedence))
+                    continue
+                case 'LPAREN':
+                    self.expect('LPAREN')
+                    operators.append(('paren', '(', 0))
+                    open_groups += 1
+                    continue
+                case 'INTEGER':
+                    operands.append(Integer(int(self.expect('INTEGER').value)))
+                case 'FLOAT':
+                    operands.append(Float(float(self.expect('FLOAT').value)))
+                case 'CHAR':
+                    operands.append(Character(self.expect('CHAR').value))
+                case 'NAME': # Either a variable name or function call
+                    name = Identifier("", self.expect('NAME').value)
+                    if self.peek().token_type != 'LPAREN':
+                        operands.append(name)
+                    else:
+                        self.expect('LPAREN')
+                        if self.peek().token_type == 'RPAREN': # No arguments
+                            self.expect('RPAREN')
+                            operands.append(FunctionCall("", name, []))
+                        else: # Arguments are collected when the call's ')' is reduced
+                            operators.append(('call', (name, len(operands)), 0))
+                            open_groups += 1
+                            continue
+                case _:
+                    raise RuntimeError(f'Expected expression but got {token}')
 
-    def parse_term(self) -> Expression:
-        next_token = self.peek()
-        match next_token.token_type:
-            case 'MINUS': # if we are here, it must be a unary op
-                self.expect('MINUS')
-                return UnaryOp("", '-', self.parse_term())
-            case 'INTEGER':
-                return Integer(int(self.expect('INTEGER').value))
-            case 'FLOAT':
-                return Float(float(self.expect('FLOAT').value))
-            case 'CHAR':
-                return Character(self.expect('CHAR').value)
-            case 'NAME': # Either a variable name or function call
-                name = Identifier("", self.expect('NAME').value)
-                if self.peek().token_type == 'LPAREN':
-                    return self.parse_func_args(name)
-                else:
-                    return name
-            case 'LPAREN':
-                self.expect('LPAREN')
-                inner = self.parse_expression()
-                self.expect('RPAREN')
-                return inner
-            case _:
-                raise RuntimeError(f'Expected expression but got {next_token}')
+            # Expecting a binary operator, or the end of a group
+            while True:
+                token = self.peek()
+                token_type = token.token_type
+                if token_type in binary_precedence:
+                    precedence = binary_precedence[token_type]
+                    while operators and operators[-1][2] >= precedence: # left associative
+                        reduce_operator(operators, operands)
+                    self.expect(token_type)
+                    operators.append(('binary', token.value, precedence))
+                    break
+                if (token_type == 'RPAREN' or token_type == 'COMMA') and open_groups:
+                    while operators[-1][0] == 'binary' or operators[-1][0] == 'unary':
+                        reduce_operator(operators, operands)
+                    kind, group, _ = operators[-1]
+                    self.expect(token_type)
+                    if token_type == 'COMMA':
+                        if kind != 'call':
+                            raise SyntaxError(f'Unexpected COMMA at {token}')
+                        break
+                    operators.pop()
+                    open_groups -= 1
+                    if kind == 'call':
+                        name, first_argument = group
+                        arguments = operands[first_argument:]
+                        del operands[first_argument:]
+                        operands.append(FunctionCall("", name, arguments))
+                    continue
+                # Anything else ends the expression
+                if open_groups:
+                    raise SyntaxError(f'Expected RPAREN at {token}')
+                while operators:
+                    reduce_operator(operators, operands)
+                return operands[0]
+
+unary_precedence = 6
+binary_precedence = {
+    'TIMES' : 5, 'DIVIDE' : 5,
+    'PLUS' : 4, 'MINUS' : 4,
+    'LT' : 3, 'LE' : 3, 'GT' : 3, 'GE' : 3, 'EQ' : 3, 'NE' : 3,
+    'AND' : 2,
+    'OR' : 1
+}
+
+def reduce_operator(operators : list, operands : list[Expression]):
+    kind, op, _ = operators.pop()
+    if kind == 'unary':
+        operands[-1] = UnaryOp("", op, operands[-1])
+    else:
+        right = operands.pop()
+        left = operands[-1]
+        if op == 'and' or op == 'or':
+            operands[-1] = LogicalOp('int', op, left, right)
+        elif op in ('<', '<=', '>', '>=', '==', '!='): # 1 or 0, whatever is compared
+            operands[-1] = BinaryOp('int', op, left, right)
+        else:
+            operands[-1] = BinaryOp(left.wtype, op, left, right)
 
-    def parse_expression(self) -> Expression:
-        term = self.parse_term()
-        peek = self.peek()
-        match peek.token_type:
-            case 'PLUS' | 'MINUS' | 'TIMES' | 'DIVIDE' | 'LT' | 'LE' | 'GT' | 'GE' | 'EQ' | 'NE':
-                self.expect(peek.token_type)
-                next_term = self.parse_term()
-                return BinaryOp(term.wtype, peek.value, term, next_term)
-            case _:
-                return term
-    
 def test_parser():
     tests = ['print 1;',
              'var x = -1;',
@@ -207,7 +267,9 @@ def test_parser():
              'func f(x float, y char, z int) int{if 1 == 1 { } else { }}',
              'func f(x int, y int, z int) int{var x = f(0,0,0); x = (2); x = x; x = (x);}',
              'func f(x int) int{var y = ((x) + 10);}',
-             'var x = 2 + (3 * (1 + 2));']
+             'var x = 2 + (3 * (1 + 2));',
+             'print -x + y * z;',
+             'print f(1 + 2, g(3) * -(4 - 5), h());']
     
     for test_program in tests:
         print(Parser(tokenize(test_program)).parse_statement())
@@ -222,4 +284,36 @@ def test_parser():
     print(Parser(tokenize(tests[6])).parse_return())
     '''
 
-#test_parser()
\ No newline at end of file
+def bench_expression(n_operators = 100000, seed = 0):
+    # Random operators over random operands, with parentheses, unary minus and calls
+    # nested as deeply as they come out
+    rng = random.Random(seed)
+    operators = ['+', '-', '*', '/', '<', '<=', '>', '>=', '==', '!=']
+    parts = []
+    open_groups = 0
+    for i in range(n_operators):
+        choice = rng.random()
+        if choice < 0.2:
+            parts.append('(')
+            open_groups += 1
+        elif choice < 0.3:
+            parts.append('f(')
+            open_groups += 1
+        elif choice < 0.4:
+            parts.append('-')
+        parts.append(rng.choice(['x', '1', 'y']))
+        if open_groups and rng.random() < 0.3:
+            parts.append(')')
+            open_groups -= 1
+        parts.append(rng.choice(operators))
+    parts.append('1' + ')' * open_groups + ';')
+    src = ' '.join(parts)
+    tokens = tokenize(f'print {src}')
+    start = time.perf_counter()
+    Parser(tokens).parse_statement()
+    elapsed = time.perf_counter() - start
+    print(f'Parsed {n_operators} binary operators ({len(tokens)} tokens) in {elapsed:.3f}s '
+          f'({n_operators / elapsed:,.0f} operators/s)')
+
+#test_parser()
+#bench_expression()
\ No newline at end of file
@@ -0,0 +1,146 @@
+# passes.py
+
+from model import *
+from dataclasses import fields
+
+# A framework for running several AST passes in a single traversal.
+# Following the comment at the top of model.py, the children of a node are found from its
+# dataclass fields: fields declared as Expression, list[Expression] or list[Statement] are
+# visited, and everything else (names, parameters, literals) is left alone.
+#
+# The walk is bottom-up. When a pass hook sees a node, that node's children have already been
+# rewritten by every pass. A node is only rebuilt when one of its children actually changed, so
+# unchanged subtrees (and statement lists) are shared with the input program instead of copied.
+#
+# For every statement the walk:
+#   1. rewrites its expression fields
+#   2. for each nested list of statements, calls enter_block, rewrites the list, calls exit_block
+#   3. feeds the statement through each pass's statement hook in order. A hook returns a list of
+#      replacement statements, and each of those is given to the next pass
+# The top-level statement list is treated as a block owned by the Program itself.
+class Pass:
+    def expression(self, e : Expression) -> Expression:
+        return e
+
+    def statement(self, s : Statement) -> list[Statement]:
+        return [s]
+
+    def enter_block(self, owner : ASTNode):
+        pass
+
+    def exit_block(self, owner : ASTNode, statements : list[Statement]) -> list[Statement]:
+        return statements
+
+EXPRESSION = 0
+EXPRESSION_LIST = 1
+STATEMENT_LIST = 2
+
+_child_fields = {} # node class -> [(field name, kind)]
+_field_names = {} # node class -> all field names
+
+def child_fields(cls : type) -> list[tuple[str, int]]:
+    children = _child_fields.get(cls)
+    if children is None:
+        children = []
+        for f in fields(cls):
+            if f.type is Expression:
+                children.append((f.name, EXPRESSION))
+            elif f.type == list[Expression]:
+                children.append((f.name, EXPRESSION_LIST))
+            elif f.type == list[Statement]:
+                children.append((f.name, STATEMENT_LIST))
+        _child_fields[cls] = children
+        _field_names[cls] = [f.name for f in fields(cls)]
+    return children
+
+def rebuild(node : ASTNode, changes : dict) -> ASTNode:
+    # Copies node with some fields replaced, without calling a possibly custom __init__
+    cls = type(node)
+    new_node = object.__new__(cls)
+    for name in _field_names[cls]:
+        setattr(new_node, name, changes[name] if name in changes else getattr(node, name))
+    return new_node
+
+def overrides(p : Pass, hook : str) -> bool:
+    return getattr(type(p), hook) is not getattr(Pass, hook)
+
+class PassRunner:
+    def __init__(self, passes : list[Pass]):
+        self.passes = passes
+        # Only call the hooks that a pass actually defines
+        self.expression_hooks = [p.expression for p in passes if overrides(p, 'expression')]
+        self.statement_hooks = [p.statement for p in passes if overrides(p, 'statement')]
+        self.block_passes = [p for p in passes if overrides(p, 'enter_block') or overrides(p, 'exit_block')]
+
+    def run(self, program : Program) -> Program:
+        statements = self.visit_block(program, program.statements)
+        if statements is program.statements:
+            return program
+        return Program(statements)
+
+    def visit_block(self, owner : ASTNode, statements : list[Statement]) -> list[Statement]:
+        for p in self.block_passes:
+            p.enter_block(owner)
+        out = []
+        changed = False
+        for s in statements:
+            new_statements = self.visit_statement(s)
+            if len(new_statements) != 1 or new_statements[0] is not s:
+                changed = True
+            out.extend(new_statements)
+        if not changed:
+            out = statements
+        for p in self.block_passes:
+            out = p.exit_block(owner, out)
+        return out
+
+    def visit_statement(self, s : Statement) -> list[Statement]:
+        changes = None
+        for name, kind in child_fields(type(s)):
+            value = getattr(s, name)
+            if kind == EXPRESSION:
+                new_value = self.visit_expression(value)
+            elif kind == EXPRESSION_LIST:
+                new_value = self.visit_expressions(value)
+            else:
+                new_value = self.visit_block(s, value)
+            if new_value is not value:
+                if changes is None:
+                    changes = {}
+                changes[name] = new_value
+        if changes:
+            s = rebuild(s, changes)
+        out = [s]
+        for hook in self.statement_hooks:
+            if len(out) == 1:
+                out = hook(out[0])
+            else:
+                out = [new_s for old_s in out for new_s in hook(old_s)]
+        return out
+
+    def visit_expressions(self, expressions : list[Expression]) -> list[Expression]:
+        out = [self.visit_expression(e) for e in expressions]
+        if all(new is old for new, old in zip(out, expressions)):
+            return expressions
+        return out
+
+    def visit_expression(self, e : Expression) -> Expression:
+        changes = None
+        for name, kind in child_fields(type(e)):
+            value = getattr(e, name)
+            if kind == EXPRESSION:
+                new_value = self.visit_expression(value)
+            else:
+                new_value = self.visit_expressions(value)
+            if new_value is not value:
+                if changes is None:
+                    changes = {}
+                changes[name] = new_value
+        if changes:
+            e = rebuild(e, changes)
+        for hook in self.expression_hooks:
+            e = hook(e)
+        return e
+
+def run_passes(program : Program, passes : list[Pass]) -> Program:
+    return PassRunner(passes).run(program)
@@ -0,0 +1,150 @@
+# passmanager.py
+
+from model import *
+from passes import Pass, run_passes, child_fields, EXPRESSION
+from inline import called_functions
+from instrument import Instrumentation, TimedPass
+from dataclasses import dataclass
+from typing import Callable
+import sys
+
+# Runs a pipeline of passes at an optimization level, from 0 to 3. Each pass is declared with:
+#   level        the lowest level that runs it (0 for the passes every program needs)
+#   make / run   makes a Pass for the traversal in passes.py, or runs on the whole Program
+#   requires     the analyses it needs, by name (see analyses below)
+#   invalidates  the analyses it may make out of date
+#   applies      called with the required analyses, False if the pass can't change this program
+# Consecutive traversal passes are fused into one run_passes, as they always have been, unless
+# one of them requires an analysis that an earlier one in the group invalidates. Then the group
+# is run first and the analysis is computed again on its output. Analyses are only computed
+# when a pass requires them, and are kept until a pass invalidates them.
+# With an Instrumentation, every pass run, or group of fused passes, is measured (see instrument.py).
+#
+# The levels are
+#   0  only what is needed to produce correct code, as fast as possible
+#   1  cheap cleanups: constant folding and propagation, simplifying the CFG
+#   2  everything: tail calls, inlining, algebra, loop-invariant motion, common subexpressions
+#   3  the same passes as 2, but clang is also asked for -O3
+
+levels = (0, 1, 2, 3)
+default_level = 2
+
+@dataclass(slots = True)
+class PassInfo:
+    name : str
+    level : int
+    make : Callable[[], Pass] | None = None
+    run : Callable[[Program], Program] | None = None
+    requires : tuple[str, ...] = ()
+    invalidates : tuple[str, ...] = ()
+    applies : Callable[..., bool] | None = None
+
+# The kinds of node the program may contain: 'floats', 'loops', 'logic' (and/or) and 'calls'.
+# Passes that only remove nodes leave it valid.
+def program_features(program : Program) -> set[str]:
+    features = set()
+    stack = list(program.statements)
+    while stack:
+        node = stack.pop()
+        match node:
+            case Float():
+                features.add('floats')
+            case While():
+                features.add('loops')
+            case LogicalOp():
+                features.add('logic')
+            case FunctionCall():
+                features.add('calls')
+        if getattr(node, 'wtype', None) == 'float':
+            features.add('floats')
+        for name, kind in child_fields(type(node)):
+            value = getattr(node, name)
+            if kind == EXPRESSION:
+                stack.append(value)
+            else:
+                stack.extend(value)
+    return features
+
+# Function name -> names of the functions it calls, once main has been made
+def call_graph(program : Program) -> dict[str, set[str]]:
+    return {s.name.string : called_functions(s.body) for s in program.statements if isinstance(s, FunctionDefinition)}
+
+analyses = {
+    'features' : program_features,
+    'call graph' : call_graph,
+}
+
+class PassManager:
+    def __init__(self, passes : list[PassInfo], level : int = default_level,
+                 instrumentation : Instrumentation | None = None, scope : str = 'program'):
+        if level not in levels:
+            raise ValueError(f'Invalid optimization level {level}')
+        self.passes = [p for p in passes if p.level <= level]
+        self.level = level
+        self.instrumentation = instrumentation
+        self.scope = scope # what the passes run on, for the instrumentation
+        self.analyses = {}
+        self.ran = [] # names of the passes run, in order
+        self.skipped = [] # names of the passes that didn't apply
+
+    def analysis(self, name : str, program : Program):
+        if name not in self.analyses:
+            self.analyses[name] = analyses[name](program)
+        return self.analyses[name]
+
+    def run(self, program : Program) -> Program:
+        self.analyses = {}
+        group = [] # (name, traversal pass) waiting to run together
+        stale = set() # analyses invalidated by the passes in group
+        for p in self.passes:
+            if group and (p.make is None or stale.intersection(p.requires)):
+                program = self.run_group(program, group, stale)
+                group, stale = [], set()
+            required = [self.analysis(name, program) for name in p.requires]
+            if p.applies is not None and not p.applies(*required):
+                self.skipped.append(p.name)
+                continue
+            self.ran.append(p.name)
+            if p.make is not None:
+                group.append((p.name, p.make()))
+                stale.update(p.invalidates)
+            else:
+                if self.instrumentation is None:
+                    program = p.run(program)
+                else:
+                    program = self.instrumentation.measure(p.name, p.run, program, self.scope)
+                for name in p.invalidates:
+                    self.analyses.pop(name, None)
+        if group:
+            program = self.run_group(program, group, stale)
+        return program
+
+    def run_group(self, program : Program, group : list[tuple[str, Pass]], stale : set[str]) -> Program:
+        if self.instrumentation is None:
+            program = run_passes(program, [p for _, p in group])
+        else:
+            timed = [(name, TimedPass(p)) for name, p in group]
+            program = self.instrumentation.measure(' + '.join(name for name, _ in group),
+                                                   lambda program: run_passes(program, [p for _, p in timed]),
+                                                   program, self.scope)
+            self.instrumentation.records[-1]['hooks'] = {name : p.seconds for name, p in timed}
+        for name in stale:
+            self.analyses.pop(name, None)
+        return program
+
+    def report(self) -> str:
+        skipped = f', skipped {", ".join(self.skipped)}' if self.skipped else ''
+        return f'-O{self.level}: ran {", ".join(self.ran)}{skipped}'
+
+# Prints the passes that run on a program at each level
+def main():
+    from main import file_to_AST, front_end_passes, back_end_passes
+    for level in levels:
+        front = PassManager(front_end_passes(), level)
+        back = PassManager(back_end_passes(), level)
+        back.run(front.run(file_to_AST(sys.argv[1])))
+        print(front.report())
+        print(f'    backend: {", ".join(back.ran)}')
+
+if __name__ == '__main__':
+    main()
@@ -5,4 +5,29 @@
 int _print_int(int value) {
     printf("Output: %i\n", value);
     return 0;
-}
\ No newline at end of file
+}
+
+int _print_float(double value) {
+    printf("Output: %f\n", value);
+    return 0;
+}
+
+/* chars hold a Unicode code point, which is written out as UTF-8 */
+int _print_char(int value) {
+    if (value < 0x80) {
+        putchar(value);
+    } else if (value < 0x800) {
+        putchar(0xC0 | (value >> 6));
+        putchar(0x80 | (value & 0x3F));
+    } else if (value < 0x10000) {
+        putchar(0xE0 | (value >> 12));
+        putchar(0x80 | ((value >> 6) & 0x3F));
+        putchar(0x80 | (value & 0x3F));
+    } else {
+        putchar(0xF0 | (value >> 18));
+        putchar(0x80 | ((value >> 12) & 0x3F));
+        putchar(0x80 | ((value >> 6) & 0x3F));
+        putchar(0x80 | (value & 0x3F));
+    }
+    return 0;
+}
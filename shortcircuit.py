@@ -0,0 +1,118 @@
+# shortcircuit.py
+
+from model import *
+from passes import Pass, child_fields, rebuild, EXPRESSION, EXPRESSION_LIST
+
+# Makes `and` and `or` short-circuit. Runs on resolved identifiers, right after the resolving
+# passes, and leaves a LogicalOp only where it is the whole test of an If or While, or one of the
+# operands of such a LogicalOp. There, controlflow turns it into conditional branches that jump
+# straight to the consequence or the alternative, so no 0/1 value is ever made:
+#     if x != 0 and 100/x > 0 { ... }     ->  [x != 0] ? [100/x > 0] : else
+#                                             [100/x > 0] ? then : else
+# Everywhere else the value is needed, so it is computed into a new local with an If:
+#     y = a and b;                        ->  local f.logic0;
+#                                             if a and b { f.logic0 = 1; } else { f.logic0 = 0; }
+#                                             y = local[f.logic0];
+# The statements that compute such a value (the pre-statements) are placed before the statement
+# that used it. An operand evaluated before one with pre-statements is saved in a local first, so
+# that it is still evaluated first, unless it is a constant or a local, which the pre-statements
+# can't change. In a While test, the pre-statements also go at the end of the body, so they run
+# again before each test. Pre-statements for the right operand of a test are nested inside an If
+# on the left operand, so that they only run when the right operand is evaluated.
+
+def is_simple(e : Expression) -> bool:
+    return isinstance(e, (Integer, Float, Character, LocalId))
+
+class LowerShortCircuit(Pass):
+    def __init__(self):
+        self.function = 'main'
+        self.count = 0 # temporaries made in this function
+
+    def enter_block(self, owner : ASTNode):
+        if isinstance(owner, FunctionDefinition):
+            self.function = owner.name.string
+            self.count = 0
+
+    def temporary(self, wtype : str, pre : list[Statement]) -> LocalId:
+        name = f'{self.function}.logic{self.count}'
+        self.count += 1
+        pre.append(LocalVarDec(Identifier(wtype, name)))
+        return LocalId(wtype, name)
+
+    def statement(self, s : Statement) -> list[Statement]:
+        match s:
+            case If(test, consequence, alternative):
+                pre, new_test = self.test(test)
+                return pre + [s if new_test is test else If(new_test, consequence, alternative)]
+            case While(test, body):
+                pre, new_test = self.test(test)
+                if not pre:
+                    return [s if new_test is test else While(new_test, body)]
+                return pre + [While(new_test, body + pre)]
+        pre = []
+        changes = {}
+        for name, kind in child_fields(type(s)):
+            if kind == EXPRESSION:
+                value = getattr(s, name)
+                new_value = self.value(value, pre)
+                if new_value is not value:
+                    changes[name] = new_value
+        return pre + [rebuild(s, changes) if changes else s]
+
+    # The test to branch on, with the pre-statements it needs
+    def test(self, e : Expression) -> tuple[list[Statement], Expression]:
+        if not isinstance(e, LogicalOp):
+            pre = []
+            return pre, self.value(e, pre)
+        left_pre, left = self.test(e.left)
+        right_pre, right = self.test(e.right)
+        if not right_pre:
+            if left is e.left and right is e.right:
+                return left_pre, e
+            return left_pre, LogicalOp('int', e.op, left, right)
+        # The right operand is only evaluated when the left one doesn't decide the result
+        pre = left_pre
+        result = self.temporary('int', pre)
+        evaluate_right = right_pre + [If(right, [Assignment(result, Integer(1))], [Assignment(result, Integer(0))])]
+        if e.op == 'and':
+            pre.append(If(left, evaluate_right, [Assignment(result, Integer(0))]))
+        else:
+            pre.append(If(left, [Assignment(result, Integer(1))], evaluate_right))
+        return pre, result
+
+    # e with every LogicalOp in it replaced by a local, adding the statements that compute it to pre
+    def value(self, e : Expression, pre : list[Statement]) -> Expression:
+        if isinstance(e, LogicalOp):
+            test_pre, test = self.test(e)
+            pre += test_pre
+            if isinstance(test, LocalId): # already 1 or 0
+                return test
+            result = self.temporary('int', pre)
+            pre.append(If(test, [Assignment(result, Integer(1))], [Assignment(result, Integer(0))]))
+            return result
+        operands = []
+        for name, kind in child_fields(type(e)):
+            if kind == EXPRESSION:
+                operands.append((name, None, getattr(e, name)))
+            elif kind == EXPRESSION_LIST:
+                operands += [(name, i, v) for i, v in enumerate(getattr(e, name))]
+        if not operands:
+            return e
+        lowered = []
+        for name, index, operand in operands:
+            operand_pre = []
+            lowered.append((name, index, operand, self.value(operand, operand_pre), operand_pre))
+        if all(new is old and not operand_pre for _, _, old, new, operand_pre in lowered):
+            return e
+        changes = {}
+        for i, (name, index, _, new, operand_pre) in enumerate(lowered):
+            pre += operand_pre
+            if not is_simple(new) and any(later_pre for *_, later_pre in lowered[i + 1:]):
+                saved = self.temporary(new.wtype, pre)
+                pre.append(Assignment(saved, new))
+                new = saved
+            if index is None:
+                changes[name] = new
+            else:
+                changes.setdefault(name, list(getattr(e, name)))[index] = new
+        return rebuild(e, changes)
@@ -0,0 +1,189 @@
+# simplifyalgebra.py
+
+from model import *
+from passes import Pass
+from foldconstants import contains_call
+import math
+import sys
+
+# Rewrites expressions into cheaper ones that always give the same result, using the rules
+# below. Runs with PropagateConstants on the resolved AST, after constants have been folded,
+# so the constant operand of a rule is always a plain Integer or Float.
+#
+# Int arithmetic wraps around at 32 bits, which keeps the usual identities true. Floats are
+# IEEE doubles, where x + 0.0 and x * 0.0 are not x (think of -0.0, NaN and infinity), so only
+# the exact float rules are used. A rule may drop an operand (x * 0) or swap the order in which
+# two operands are evaluated ((-a) + b -> b - a), and then it only applies when no call is
+# involved. Dividing by a power of two isn't turned into a shift, since sdiv truncates towards
+# zero and a shift rounds down, and nothing here knows that x is not negative.
+#
+# Every rule that fires is counted in hits, by name, so report() shows which ones pay off.
+# A SimplifyAlgebra only uses the rules it is given, by default all but the float_rules.
+
+def is_int(e : Expression, n : int) -> bool:
+    return isinstance(e, Integer) and e.n == n
+
+def is_float(e : Expression, n : float) -> bool:
+    return isinstance(e, Float) and e.n == n
+
+def pure(*expressions : Expression) -> bool:
+    return not any(contains_call(e) for e in expressions)
+
+def negate(e : Expression) -> Expression:
+    return UnaryOp(e.wtype, '-', e)
+
+def same(left : Expression, right : Expression) -> bool:
+    # The same variable, not just the same name (GlobalId x == LocalId x for Identifier.__eq__)
+    return type(left) is type(right) and isinstance(left, (LocalId, GlobalId)) and left.string == right.string
+
+def shift_amount(e : Expression) -> int | None: # k if e is the int 2**k, for k >= 1
+    if isinstance(e, Integer) and e.n > 1 and e.n & (e.n - 1) == 0:
+        return e.n.bit_length() - 1
+    return None
+
+def exact_reciprocal(e : Expression) -> float | None: # 1/c, if c is a power of two and 1/c is exact
+    if isinstance(e, Float) and e.n != 0.0 and math.isfinite(e.n):
+        mantissa, exponent = math.frexp(e.n)
+        if abs(mantissa) == 0.5 and -1021 <= 2 - exponent <= 1024:
+            return 1.0 / e.n
+    return None
+
+# Each rule returns the simplified expression, or None if it doesn't apply
+def add_zero(e):
+    match e:
+        case BinaryOp('+', x, zero) if e.wtype == 'int' and is_int(zero, 0):
+            return x
+        case BinaryOp('+', zero, x) if e.wtype == 'int' and is_int(zero, 0):
+            return x
+        case BinaryOp('-', x, zero) if is_int(zero, 0) or is_float(zero, 0.0):
+            return x # x - 0.0 is x even for x = -0.0
+
+def subtract_from_zero(e):
+    match e:
+        case BinaryOp('-', zero, x) if is_int(zero, 0):
+            return negate(x)
+
+def subtract_self(e):
+    match e:
+        case BinaryOp('-', x, y) if e.wtype == 'int' and same(x, y):
+            return Integer(0)
+
+def multiply_one(e):
+    match e:
+        case BinaryOp('*' | '/', x, one) if is_int(one, 1) or is_float(one, 1.0):
+            return x
+        case BinaryOp('*', one, x) if is_int(one, 1) or is_float(one, 1.0):
+            return x
+
+def multiply_zero(e):
+    match e:
+        case BinaryOp('*', x, zero) if e.wtype == 'int' and is_int(zero, 0) and pure(x):
+            return Integer(0)
+        case BinaryOp('*', zero, x) if e.wtype == 'int' and is_int(zero, 0) and pure(x):
+            return Integer(0)
+
+def multiply_minus_one(e):
+    match e:
+        case BinaryOp('*' | '/', x, minus_one) if is_int(minus_one, -1) or is_float(minus_one, -1.0):
+            return negate(x)
+        case BinaryOp('*', minus_one, x) if is_int(minus_one, -1) or is_float(minus_one, -1.0):
+            return negate(x)
+
+def double_negation(e):
+    match e:
+        case UnaryOp('-', UnaryOp('-', x)):
+            return x
+
+def negate_subtraction(e):
+    match e:
+        case UnaryOp('-', BinaryOp('-', a, b)) if e.wtype == 'int' and pure(a, b):
+            return BinaryOp('int', '-', b, a) # not for floats: -(x - x) is -0.0, x - x is 0.0
+
+def add_negation(e):
+    match e:
+        case BinaryOp('+', a, UnaryOp('-', b)):
+            return BinaryOp(e.wtype, '-', a, b)
+        case BinaryOp('+', UnaryOp('-', a), b) if pure(a, b):
+            return BinaryOp(e.wtype, '-', b, a)
+        case BinaryOp('-', a, UnaryOp('-', b)):
+            return BinaryOp(e.wtype, '+', a, b)
+
+def multiply_power_of_two(e):
+    match e:
+        case BinaryOp('*', x, c) if e.wtype == 'int' and shift_amount(c):
+            return BinaryOp('int', '<<', x, Integer(shift_amount(c)))
+        case BinaryOp('*', c, x) if e.wtype == 'int' and shift_amount(c):
+            return BinaryOp('int', '<<', x, Integer(shift_amount(c)))
+
+def float_times_two(e):
+    match e:
+        case BinaryOp('*', x, two) if is_float(two, 2.0) and isinstance(x, (LocalId, GlobalId)):
+            return BinaryOp('float', '+', x, x)
+        case BinaryOp('*', two, x) if is_float(two, 2.0) and isinstance(x, (LocalId, GlobalId)):
+            return BinaryOp('float', '+', x, x)
+
+def float_divide_power_of_two(e):
+    match e:
+        case BinaryOp('/', x, c) if exact_reciprocal(c) is not None:
+            return BinaryOp('float', '*', x, Float(exact_reciprocal(c)))
+
+rules = [
+    ('x + 0', add_zero),
+    ('0 - x', subtract_from_zero),
+    ('x - x', subtract_self),
+    ('x * 1', multiply_one),
+    ('x * 0', multiply_zero),
+    ('x * -1', multiply_minus_one),
+    ('-(-x)', double_negation),
+    ('-(a - b)', negate_subtraction),
+    ('a + -b', add_negation),
+    ('x * 2^k', multiply_power_of_two),
+]
+
+# Only for float constants, so the pass manager runs them as a separate pass, on programs with floats
+float_rules = [
+    ('2.0 * x', float_times_two),
+    ('x / 2.0^k', float_divide_power_of_two),
+]
+
+class SimplifyAlgebra(Pass):
+    def __init__(self, rules : list = rules):
+        self.rules = rules
+        self.hits = {name : 0 for name, _ in rules}
+
+    # The operands have already been simplified, so only the rewritten node is looked at again
+    def expression(self, e : Expression) -> Expression:
+        while isinstance(e, (BinaryOp, UnaryOp)):
+            for name, rule in self.rules:
+                new_e = rule(e)
+                if new_e is not None:
+                    self.hits[name] += 1
+                    e = new_e
+                    break
+            else:
+                break
+        return e
+
+    def report(self) -> str:
+        fired = sorted(((n, name) for name, n in self.hits.items() if n), reverse = True)
+        if not fired:
+            return 'No algebraic simplifications'
+        rules_used = ', '.join(f'{name} (x{n})' for n, name in fired)
+        return f'Simplified {sum(n for n, _ in fired)} expressions: {rules_used}'
+
+# Prints how often each rule fires over a set of programs
+def main():
+    from main import file_to_AST, front_end
+    simplifier = SimplifyAlgebra(rules + float_rules)
+    for filename in sys.argv[1:]:
+        try:
+            front_end(file_to_AST(filename), simplifier = simplifier)
+        except (SyntaxError, RuntimeError) as e:
+            print(f'Skipped {filename}: {e}')
+    width = max(len(name) for name in simplifier.hits)
+    for name, n in simplifier.hits.items():
+        print(f'{name:<{width}}  {n}')
+    print(simplifier.report())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# simplifycfg.py
+
+from model import *
+from instructionsmodel import *
+import sys
+
+# Cleans up the blocks made by add_control_flow, one function at a time:
+#   1. anything after a block's first RETURN/GOTO/CBRANCH is dropped
+#   2. a CBRANCH on a constant becomes a GOTO, and a CBRANCH whose targets are the same block
+#      becomes POP + GOTO
+#   3. jumps to blocks that contain nothing but a GOTO are threaded straight to its destination
+#   4. blocks that can't be reached from the first block are removed
+#   5. a block ending in a GOTO absorbs its destination, if nothing else jumps there
+# The first block of each function stays first, since it is where the function starts.
+
+def simplify_cfg(program : Program) -> Program:
+    new_statements = []
+    for s in program.statements:
+        match s:
+            case FunctionDefinition():
+                new_statements.append(simplify_function(s))
+            case GlobalVarDec():
+                new_statements.append(s)
+            case _:
+                raise RuntimeError(f'Unexpected statement type {s} when simplifying the CFG')
+    return Program(new_statements)
+
+def simplify_function(function : FunctionDefinition) -> FunctionDefinition:
+    # Work on labels: body[label] is the block without its jump, succs[label] is where it jumps
+    # (one label for GOTO, true and false labels for CBRANCH, none after a RETURN)
+    order = []
+    body = {}
+    succs = {}
+    for block in function.body:
+        instructions = []
+        targets = []
+        for instr in block.instructions:
+            match instr:
+                case GOTO(destination):
+                    targets = [destination.label]
+                    break
+                case CBRANCH(true_block, false_block):
+                    targets = [true_block.label, false_block.label]
+                    break
+                case RETURN() | FRETURN():
+                    instructions.append(instr)
+                    break
+                case _:
+                    instructions.append(instr)
+        order.append(block.label)
+        body[block.label] = instructions
+        succs[block.label] = targets
+    first = order[0]
+
+    for label in order:
+        instructions = body[label]
+        targets = succs[label]
+        if len(targets) == 2 and instructions and isinstance(instructions[-1], PUSH):
+            succs[label] = [targets[0] if instructions.pop().value else targets[1]]
+    for label in order:
+        targets = [forward(t, body, succs) for t in succs[label]]
+        if len(targets) == 2 and targets[0] == targets[1]:
+            body[label].append(POP())
+            targets = targets[:1]
+        succs[label] = targets
+
+    reachable = {first}
+    stack = [first]
+    while stack:
+        for t in succs[stack.pop()]:
+            if t not in reachable:
+                reachable.add(t)
+                stack.append(t)
+    order = [label for label in order if label in reachable]
+
+    preds = dict.fromkeys(order, 0)
+    for label in order:
+        for t in succs[label]:
+            preds[t] += 1
+    merged = set()
+    for label in order:
+        if label in merged:
+            continue
+        while len(succs[label]) == 1:
+            t = succs[label][0]
+            if t == label or t == first or preds[t] != 1:
+                break
+            body[label] = body[label] + body[t]
+            succs[label] = succs[t]
+            merged.add(t)
+    order = [label for label in order if label not in merged]
+
+    blocks = {label : BLOCK(label, []) for label in order}
+    for label in order:
+        match succs[label]:
+            case [t]:
+                jump = [GOTO(blocks[t])]
+            case [t, f]:
+                jump = [CBRANCH(blocks[t], blocks[f])]
+            case _:
+                jump = []
+        blocks[label].instructions = body[label] + jump
+    return FunctionDefinition(function.name, function.parameters, list(blocks.values()))
+
+# The block that a jump to label ends up at, skipping blocks that only jump elsewhere
+def forward(label : str, body : dict, succs : dict) -> str:
+    seen = set()
+    while not body[label] and len(succs[label]) == 1 and label not in seen:
+        seen.add(label)
+        label = succs[label][0]
+    return label
+
+# Prints the number of blocks in each function of a program before and after simplification
+def main():
+    from main import file_to_AST, front_end
+    from createinstructions import exps_stmts_to_instr
+    from createblocks import create_blocks
+    from controlflow import add_control_flow
+    program = add_control_flow(create_blocks(exps_stmts_to_instr(front_end(file_to_AST(sys.argv[1])))))
+    total_before = total_after = 0
+    for before, after in zip(program.statements, simplify_cfg(program).statements):
+        if isinstance(before, FunctionDefinition):
+            print(f'{before.name.string}: {len(before.body)} -> {len(after.body)} blocks')
+            total_before += len(before.body)
+            total_after += len(after.body)
+    print(f'Total: {total_before} -> {total_after} blocks')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# tailcalls.py
+
+from model import *
+
+# Turns self-recursive calls in return statements into jumps back to the start of the function,
+# so that deep recursion runs in constant stack space. The body of f is wrapped in
+#     while 1 { inlined f as f.tail { ...body... } }
+# and every  return f(a, b);  inside it becomes
+#     local f.p.next; f.p.next = a;      (arguments are evaluated before any parameter changes)
+#     local f.q.next; f.q.next = b;
+#     p = f.p.next; q = f.q.next;
+#     leave f.tail;                      (jump to the end of the inlined body, so round the loop)
+# Other returns still leave the function.
+#
+# Returns of the form  x + f(...)  or  x * f(...)  (either way round) on ints are handled too,
+# by carrying the pending operations in an accumulator, f.acc: the function returns
+# f.acc op e wherever it used to return e, and a recursive return updates f.acc = f.acc op x
+# before jumping. Int arithmetic wraps around, so + and * are associative and commutative and
+# this gives the same result. It is only done when all such returns use the same operator, and
+# x contains no calls and no globals, so evaluating it before the arguments can't change it.
+#
+# Calls that can't be rewritten are left alone. When their result is returned directly, the
+# LLVM backend marks them as tail calls instead.
+
+identities = {'+' : 0, '*' : 1}
+
+def eliminate_tail_calls(program : Program) -> Program:
+    new_statements = []
+    for s in program.statements:
+        if isinstance(s, FunctionDefinition):
+            s = eliminate_in_function(s)
+        new_statements.append(s)
+    return Program(new_statements)
+
+def eliminate_in_function(function : FunctionDefinition) -> FunctionDefinition:
+    name = function.name.string
+    returns = list(find_returns(function.body))
+    op = accumulator_op(returns, name)
+    if not any(recursive_return(r.value, name, op) for r in returns):
+        return function
+    acc = LocalId('int', f'{name}.acc') if op else None
+    body = rewrite_returns(function.body, function, op, acc)
+    new_body = []
+    if op:
+        new_body += [LocalVarDec(Identifier('int', acc.string)), Assignment(acc, Integer(identities[op]))]
+    new_body.append(While(Integer(1), [InlinedBody(Identifier(function.name.wtype, name), f'{name}.tail', body)]))
+    new_body.append(Return(Float(0.0) if function.name.wtype == 'float' else Integer(0))) # unreachable
+    return FunctionDefinition(function.name, function.parameters, new_body)
+
+def find_returns(statements : list[Statement]):
+    for s in statements:
+        match s:
+            case Return():
+                yield s
+            case If(_, consequence, alternative):
+                yield from find_returns(consequence)
+                yield from find_returns(alternative)
+            case While(_, body):
+                yield from find_returns(body)
+
+def is_self_call(e : Expression, name : str) -> bool:
+    return isinstance(e, FunctionCall) and e.name.string == name
+
+# The operator shared by every return of the form x op f(...), if they can all use an accumulator
+def accumulator_op(returns : list[Return], name : str) -> str | None:
+    ops = set()
+    for r in returns:
+        match r.value:
+            case BinaryOp(op, left, right) if is_self_call(left, name) or is_self_call(right, name):
+                other = right if is_self_call(left, name) else left
+                if op not in identities or r.value.wtype != 'int' or not pure_locals(other):
+                    return None
+                ops.add(op)
+    return ops.pop() if len(ops) == 1 else None
+
+def pure_locals(e : Expression) -> bool:
+    match e:
+        case Integer() | LocalId():
+            return True
+        case BinaryOp(_, left, right):
+            return pure_locals(left) and pure_locals(right)
+        case _:
+            return False
+
+# The self call in a return value that can be turned into a jump, if any, and the other operand
+def recursive_return(value : Expression, name : str, op : str | None):
+    if is_self_call(value, name):
+        return value, None
+    match value:
+        case BinaryOp(value_op, left, right) if value_op == op:
+            if is_self_call(left, name):
+                return left, right
+            if is_self_call(right, name):
+                return right, left
+    return None
+
+def rewrite_returns(statements : list[Statement], function : FunctionDefinition,
+                    op : str | None, acc : LocalId | None) -> list[Statement]:
+    name = function.name.string
+    out = []
+    for s in statements:
+        match s:
+            case Return(value):
+                found = recursive_return(value, name, op)
+                if found is None:
+                    out.append(Return(BinaryOp('int', op, acc, value)) if op else s)
+                    continue
+                call, other = found
+                if other is not None:
+                    out.append(Assignment(acc, BinaryOp('int', op, acc, other)))
+                temps = []
+                for param, argument in zip(function.parameters.data, call.arguments):
+                    temp = LocalId(param.wtype, f'{name}.{param.string}.next')
+                    out.append(LocalVarDec(Identifier(param.wtype, temp.string)))
+                    out.append(Assignment(temp, argument))
+                    temps.append(temp)
+                for param, temp in zip(function.parameters.data, temps):
+                    out.append(Assignment(LocalId(param.wtype, param.string), temp))
+                out.append(LeaveInlined(f'{name}.tail'))
+            case If(test, consequence, alternative):
+                out.append(If(test, rewrite_returns(consequence, function, op, acc),
+                              rewrite_returns(alternative, function, op, acc)))
+            case While(test, body):
+                out.append(While(test, rewrite_returns(body, function, op, acc)))
+            case _:
+                out.append(s)
+    return out
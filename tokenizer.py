@@ -1,9 +1,16 @@
 from dataclasses import dataclass
+import gc
+import mmap
+import os
+import re
+import time
 
-@dataclass
+@dataclass(slots = True)
 class Token:
     token_type : str
     value : str
+    line : int = 0 # 1-based source position, 0 for tokens made up by the parser
+    column : int = 0
 
 symbols = {
     '+' : 'PLUS',
@@ -34,92 +41,93 @@ keywords = {
     'while' : 'WHILE',
     'func' : 'FUNC',
     'return' : 'RETURN',
+    'and' : 'AND',
+    'or' : 'OR',
     'int' : 'TYPE',
     'float' : 'TYPE',
     'char' : 'TYPE'
 }
 
+# One master pattern for every lexeme. Whitespace and comments are absorbed as a prefix of
+# the next match instead of being matched on their own, so there is one match per token.
+# Every symbol gets a group named after its token type, so the matched group is the type.
+# Symbols are sorted longest first so that '<=' wins over '<'.
+token_patterns = [
+    ('WORD', r'[^\W\d]\w*'),
+    ('FLOAT', r'\d+\.\d*'),
+    ('INTEGER', r'\d+'),
+    ('CHAR', r"'[^']*'"),
+    ('UNCLOSED', r"'"),
+    *[(symbols[s], re.escape(s)) for s in sorted(symbols, key = len, reverse = True)],
+    ('EOF', r'\Z'),
+    ('MISMATCH', r'.'),
+]
+master_pattern = re.compile(r'(?:\s+|//[^\n]*)*(?:' +
+                            '|'.join(f'(?P<{name}>{pattern})' for name, pattern in token_patterns) + ')')
+# The same pattern over bytes, for scanning memory-mapped files without decoding them first.
+# Over bytes, \w, \s and \d only know ASCII, so it is only used on files that contain nothing
+# but printable ASCII and ASCII whitespace, where it gives the same tokens as master_pattern.
+master_bytes_pattern = re.compile(master_pattern.pattern.encode())
+not_plain_ascii = re.compile(rb'[^\t\n\v\f\r\x20-\x7e]')
+special_kinds = {'CHAR', 'UNCLOSED', 'EOF', 'MISMATCH'}
+
 def tokenize(text : str) -> list[Token]:
-    def peek(n):
-        if n < len(text):
-            return text[n]
-        return '\0'
-    
-    i = 0
-    tokens = []
-    while i < len(text):
-        c = text[i]
-        if c.isspace():
-            i += 1
-        elif c == '/': # Check for comments
-            if peek(i+1) == '/':
-                end_line = text.find('\n', i)
-                #print(f'Skipping comment from {i} to {end_line}')
-                if end_line == -1:
-                    i = len(text)
-                else:
-                    i = end_line
-                #tokens.append(Token('COMMENT', text[i:end_line]))
-            else:
-                tokens.append(Token('DIVIDE', '/'))
-                i += 1
-        elif c in symbols: # Check for symbols
-            if c == '=' and peek(i + 1) == '=':
-                i += 1
-                tokens.append(Token('EQ', '=='))
-            elif c == '<' and peek(i + 1) == '=':
-                i += 1
-                tokens.append(Token('LE', '<='))
-            elif c == '>' and peek(i + 1) == '=':
-                i += 1
-                tokens.append(Token('GE', '>='))
-            elif c == '!' and peek(i + 1) == '=':
-                i += 1
-                tokens.append(Token('NE', '!='))
-            else:
-                tokens.append(Token(symbols[c], c))
-            i += 1
-        elif c.isdigit():
-            num = c
-            i += 1
-            while i < len(text) and text[i].isdigit():
-                num += text[i]
-                i += 1
-            if peek(i) == '.': # float detected
-                num += '.'
-                i += 1
-                while peek(i).isdigit():
-                    num += text[i]
-                    i += 1
-                tokens.append(Token('FLOAT', num))
-            else:
-                tokens.append(Token('INTEGER', num))
-        elif c == "'":
-            i += 1
-            char = ''
-            while peek(i) != "'" and peek(i) != '\0':
-                char += text[i]
-                i += 1
-            if peek(i) == '\0':
-                raise RuntimeError(f'Unclosed char at {char}')
-            #print(char)
-            i += 1
-            tokens.append(Token('CHAR', char))
-        elif c.isalpha() or c == '_':
-            word = c
-            i += 1
-            while i < len(text) and text[i].isalnum() or text[i] == '_':
-                word += text[i]
-                i += 1
-            if word in keywords:
-                tokens.append(Token(keywords[word], word))
-            else:
-                tokens.append(Token('NAME', word))
+    # Tokens never reference each other, so the cyclic GC only slows down building the list
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(iter_tokens(text))
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+# Yields tokens one at a time from a str, or from any bytes-like source such as an mmap
+def iter_tokens(text):
+    binary = not isinstance(text, str)
+    pattern, newline = (master_bytes_pattern, b'\n') if binary else (master_pattern, '\n')
+    line = 1
+    line_start = 0
+    for m in pattern.finditer(text):
+        kind = m.lastgroup
+        start = m.start(kind)
+        skipped = m.start()
+        if start != skipped: # count the newlines in the whitespace and comments before the token
+            prefix = text[skipped:start]
+            newlines = prefix.count(newline)
+            if newlines:
+                line += newlines
+                line_start = skipped + prefix.rfind(newline) + 1
+        if kind == 'WORD':
+            value = m.group(kind).decode() if binary else m.group(kind)
+            yield Token(keywords.get(value, 'NAME'), value, line, start - line_start + 1)
+        elif kind not in special_kinds: # symbols and numbers
+            yield Token(kind, m.group(kind).decode() if binary else m.group(kind), line, start - line_start + 1)
+        elif kind == 'CHAR':
+            value = m.group(kind).decode() if binary else m.group(kind)
+            yield Token('CHAR', value[1:-1], line, start - line_start + 1)
+            if '\n' in value:
+                line += value.count('\n')
+                line_start = start + value.rfind('\n') + 1
+        elif kind == 'EOF':
+            yield Token('EOF', '', line, start - line_start + 1)
+            return
+        elif kind == 'UNCLOSED':
+            raise RuntimeError(f'Unclosed char at line {line}, column {start - line_start + 1}')
         else:
-            raise RuntimeError(f"Can't match {c} in {text}")
+            raise RuntimeError(f"Can't match {m.group(kind)!r} at line {line}, column {start - line_start + 1}")
 
-    tokens.append(Token('EOF', ''))
-    return tokens
+# Streams the tokens of a file straight out of a read-only memory map, so neither the source
+# text nor the token list has to be held in memory while parsing
+def iter_file_tokens(filename : str):
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0: # empty files can't be mapped
+            yield from iter_tokens(b'')
+            return
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as source:
+            if not_plain_ascii.search(source) is None:
+                yield from iter_tokens(source)
+            else: # decode, so that names and chars can be any letter and columns count characters
+                yield from iter_tokens(str(source, 'utf-8'))
 
 def test_symbols():
     print(tokenize("abc abc123"))
@@ -129,6 +137,14 @@ def test_symbols():
     print(tokenize('if a < b { statement1; statement2;} else {statement3;statement4;}'))
     print(tokenize('else if func print return var while elsee'))
 
+def test_file_tokens():
+    # Memory-mapped files must give the same tokens as their decoded text
+    for name in ['mandel.wb', 'unicode.wb']:
+        with open(f'tests/{name}', encoding = 'utf-8') as file:
+            src = file.read()
+        same = tokenize(src) == list(iter_file_tokens(f'tests/{name}'))
+        print(f"{name}: {'same tokens' if same else 'DIFFERENT tokens'}")
+
 def tokenize_programs():
     file_names = ['fact.wb', 'program1.wb']
     for name in file_names:
@@ -137,5 +153,18 @@ def tokenize_programs():
         
         print(tokenize(src))
 
+def bench_tokenize(copies = 2000, runs = 3):
+    with open('tests/mandel.wb', 'r') as file:
+        src = file.read() * copies
+    elapsed = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        tokens = tokenize(src)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f'{len(tokens)} tokens from {len(src)} bytes in {elapsed:.3f}s '
+          f'({len(tokens) / elapsed:,.0f} tokens/s)')
+
 #test_symbols()
-#tokenize_programs()
\ No newline at end of file
+#test_file_tokens()
+#tokenize_programs()
+#bench_tokenize()
\ No newline at end of file
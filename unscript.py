@@ -1,22 +1,29 @@
 # unscript.py
 from model import *
+from passes import Pass, run_passes
+
 def unscript_toplevel(program : Program) -> Program:
-    # Split the top-level program into three categories:
-    # Global variable declarations
-    # Function declarations
-    # Main
-    declarations = []
-    functions = []
-    main_statements = []
-    for s in program.statements:
-        match s:
-            case FunctionDefinition():
-                functions.append(s)
-            case GlobalVarDec():
-                declarations.append(s)
-            case _:
-                main_statements.append(s)
-    functions.append(FunctionDefinition(Identifier("", 'main'), Parameters("", []),
-                                        main_statements))
-    return Program(declarations + functions)
-    
\ No newline at end of file
+    return run_passes(program, [UnscriptToplevel()])
+
+class UnscriptToplevel(Pass):
+    def exit_block(self, owner : ASTNode, statements : list[Statement]) -> list[Statement]:
+        if not isinstance(owner, Program):
+            return statements
+        # Split the top-level program into three categories:
+        # Global variable declarations
+        # Function declarations
+        # Main
+        declarations = []
+        functions = []
+        main_statements = []
+        for s in statements:
+            match s:
+                case FunctionDefinition():
+                    functions.append(s)
+                case GlobalVarDec():
+                    declarations.append(s)
+                case _:
+                    main_statements.append(s)
+        functions.append(FunctionDefinition(Identifier('int', 'main'), Parameters("", []),
+                                            main_statements))
+        return declarations + functions
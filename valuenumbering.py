@@ -0,0 +1,151 @@
+# valuenumbering.py
+
+from model import *
+from instructionsmodel import *
+import sys
+
+# Common subexpression elimination inside basic blocks, by local value numbering on the stack
+# instructions left by simplify_cfg. Each block is run on a symbolic stack where every entry is
+# a value number, and an ARITHMETIC, RELATION or NEG instruction gets the same number as an
+# earlier one with the same operation and operand numbers (in either order for + * == !=).
+# Loads are numbered by variable and by a version that every store to it increases, so:
+#   - storing to a local, or redeclaring it, gives its later loads new numbers
+#   - storing to a global does the same, and so does any CALL, for every global
+#   - a CALL's result always gets a new number, so nothing containing a call is ever shared
+#
+# When a value is computed twice, the first computation is saved in a new local
+# (<function>.cse<N>), and each later one, from its first operand's instruction up to the
+# operation, is replaced by a load of that local. The largest repeated expression is done
+# first and the block is numbered again, so (x*x + y*y) repeated is saved once, rather than
+# saving x*x and y*y as well. The locals are declared at the start of the function's first
+# block, which gives the VM a slot for them; in the LLVM backend they are just SSA values.
+
+commutative = (ADD, MULT, EQ, NE, FADD, FMULT, FEQ, FNE)
+float_results = (FADD, FMINUS, FMULT, FDIVIDE, FNEG)
+
+def eliminate_common_subexpressions(program : Program) -> Program:
+    new_statements = []
+    for s in program.statements:
+        match s:
+            case FunctionDefinition():
+                new_statements.append(eliminate_in_function(s)[0])
+            case GlobalVarDec():
+                new_statements.append(s)
+            case _:
+                raise RuntimeError(f'Unexpected statement type {s} when eliminating common subexpressions')
+    return Program(new_statements)
+
+# The new function, and the number of ARITHMETIC/RELATION/NEG instructions removed from it
+def eliminate_in_function(function : FunctionDefinition) -> tuple[FunctionDefinition, int]:
+    temporaries = []
+    eliminated = 0
+    blocks = []
+    for block in function.body:
+        instructions = block.instructions
+        while True:
+            repeated = find_repeated(instructions)
+            if repeated is None:
+                break
+            temporary = f'{function.name.string}.cse{len(temporaries)}'
+            temporaries.append((temporary, isinstance(instructions[repeated[0][1]], float_results)))
+            instructions, removed = share_value(instructions, repeated, temporary, temporaries[-1][1])
+            eliminated += removed
+        blocks.append(block if instructions is block.instructions else BLOCK(block.label, instructions))
+    if temporaries:
+        declarations = [FLOCAL(name) if is_float else LOCAL(name) for name, is_float in temporaries]
+        blocks[0] = BLOCK(blocks[0].label, declarations + blocks[0].instructions)
+    return FunctionDefinition(function.name, function.parameters, blocks), eliminated
+
+# The (start, end) instruction spans of the repeated computation with the longest span, if any
+def find_repeated(instructions : list[INSTRUCTION]) -> list[tuple[int, int]] | None:
+    numbers = {} # key -> value number
+    spans = {} # value number -> [(start, end)] of every computation of it
+    versions = {} # variable name -> number of stores to it so far
+    calls = 0
+    stack = [] # (value number, index of the first instruction computing it)
+    def number(key):
+        return numbers.setdefault(key, len(numbers))
+    for i, instr in enumerate(instructions):
+        match instr:
+            case PUSH(value) | FPUSH(value): # repr, so that 0.0 and -0.0 are told apart
+                stack.append((number((type(instr), repr(value))), i))
+            case LOAD_LOCAL(name) | FLOAD_LOCAL(name):
+                stack.append((number(('local', name, versions.get(name, 0))), i))
+            case LOAD_GLOBAL(name) | FLOAD_GLOBAL(name):
+                stack.append((number(('global', name, versions.get(('global', name), 0), calls)), i))
+            case ARITHMETIC() | RELATION():
+                right, _ = stack.pop()
+                left, start = stack.pop()
+                if isinstance(instr, commutative) and right < left:
+                    left, right = right, left
+                value = number((type(instr), left, right))
+                spans.setdefault(value, []).append((start, i))
+                stack.append((value, start))
+            case NEG() | FNEG():
+                operand, start = stack.pop()
+                value = number((type(instr), operand))
+                spans.setdefault(value, []).append((start, i))
+                stack.append((value, start))
+            case CALL(_, _, args):
+                start = i
+                for _ in args:
+                    start = stack.pop()[1]
+                calls += 1
+                stack.append((number(('call', i)), start))
+            case STORE_LOCAL(name) | FSTORE_LOCAL(name):
+                stack.pop()
+                versions[name] = versions.get(name, 0) + 1
+            case LOCAL(name) | FLOCAL(name):
+                versions[name] = versions.get(name, 0) + 1
+            case STORE_GLOBAL(name) | FSTORE_GLOBAL(name):
+                stack.pop()
+                versions[('global', name)] = versions.get(('global', name), 0) + 1
+            case POP() | PRINT() | FPRINT() | CPRINT() | RETURN() | FRETURN() | CBRANCH():
+                stack.pop()
+            case GOTO():
+                pass
+            case _:
+                raise RuntimeError(f'Unknown instruction type {instr} found during value numbering')
+    best = None
+    for occurrences in spans.values():
+        if len(occurrences) > 1:
+            start, end = occurrences[0]
+            if best is None or end - start > best[0][1] - best[0][0]:
+                best = occurrences
+    return best
+
+def share_value(instructions : list[INSTRUCTION], occurrences : list[tuple[int, int]],
+                temporary : str, is_float : bool) -> tuple[list[INSTRUCTION], int]:
+    store, load = (FSTORE_LOCAL, FLOAD_LOCAL) if is_float else (STORE_LOCAL, LOAD_LOCAL)
+    (first_start, first_end), *later = occurrences
+    new_instructions = instructions[:first_end + 1] + [store(temporary), load(temporary)]
+    position = first_end + 1
+    removed = 0
+    for start, end in later:
+        new_instructions += instructions[position:start]
+        removed += sum(1 for instr in instructions[start:end + 1] if isinstance(instr, (ARITHMETIC, RELATION, NEG, FNEG)))
+        new_instructions.append(load(temporary))
+        position = end + 1
+    new_instructions += instructions[position:]
+    return new_instructions, removed
+
+# Prints the number of operations removed from each function of a program
+def main():
+    from main import file_to_AST, front_end
+    from createinstructions import exps_stmts_to_instr
+    from createblocks import create_blocks
+    from controlflow import add_control_flow
+    from simplifycfg import simplify_cfg
+    program = simplify_cfg(add_control_flow(create_blocks(exps_stmts_to_instr(front_end(file_to_AST(sys.argv[1]))))))
+    total = 0
+    for s in program.statements:
+        if isinstance(s, FunctionDefinition):
+            before = sum(len(block.instructions) for block in s.body)
+            function, eliminated = eliminate_in_function(s)
+            after = sum(len(block.instructions) for block in function.body)
+            print(f'{s.name.string}: {eliminated} operations eliminated, {before} -> {after} instructions')
+            total += eliminated
+    print(f'Total: {total} operations eliminated')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+# vm.py
+
+from model import *
+from instructionsmodel import *
+import sys
+
+# Executes the output of add_control_flow directly, without going through LLVM and clang.
+# The blocks are first assembled into one flat list of code, where every instruction takes
+# exactly 3 slots: [opcode, a, b]. Labels, function names and variable names are all resolved
+# to integers during assembly:
+#   PUSH(value)                 a = value
+#   LOAD_*/STORE_*/LOCAL(name)  a = local or global slot index
+#   GOTO(block)                 a = pc of block
+#   CBRANCH(true, false)        a = pc of true block, b = pc of false block
+#   CALL(name, type, args)      a = function index, b = number of arguments
+# The interpreter loop then looks up each opcode in a table of handlers. Every handler
+# receives (a, b, pc of next instruction) and returns the pc to continue at, or -1 to halt.
+
+WIDTH = 3
+
+# Instruction class -> opcode. The order here must match VM.handlers
+opcodes = {cls : i for i, cls in enumerate([
+    PUSH, FPUSH, POP,
+    ADD, MINUS, MULT, DIVIDE, SHL, NEG,
+    FADD, FMINUS, FMULT, FDIVIDE, FNEG,
+    LT, LE, GT, GE, EQ, NE,
+    FLT, FLE, FGT, FGE, FEQ, FNE,
+    LOAD_GLOBAL, FLOAD_GLOBAL, LOAD_LOCAL, FLOAD_LOCAL,
+    STORE_GLOBAL, FSTORE_GLOBAL, STORE_LOCAL, FSTORE_LOCAL,
+    LOCAL, FLOCAL,
+    PRINT, FPRINT, CPRINT,
+    CALL, RETURN, FRETURN,
+    GOTO, CBRANCH
+])}
+
+class Function:
+    def __init__(self, name : str, entry : int, n_params : int, n_locals : int):
+        self.name = name
+        self.entry = entry
+        self.n_params = n_params
+        self.n_locals = n_locals
+
+class Module:
+    def __init__(self):
+        self.code = [] # flat [opcode, a, b, opcode, a, b, ...]
+        self.functions = [] # function index -> Function
+        self.function_index = {} # name -> function index
+        self.global_slots = {} # name -> global slot index
+
+def assemble(program : Program) -> Module:
+    module = Module()
+    for s in program.statements:
+        match s:
+            case GlobalVarDec(name):
+                module.global_slots[name.string] = len(module.global_slots)
+            case FunctionDefinition(name):
+                module.function_index[name.string] = len(module.function_index)
+            case _:
+                raise RuntimeError(f'Unexpected statement type {s} when assembling')
+    for s in program.statements:
+        if isinstance(s, FunctionDefinition):
+            module.functions.append(assemble_function(s, module))
+    return module
+
+def assemble_function(function : FunctionDefinition, module : Module) -> Function:
+    code = module.code
+    local_slots = {}
+    for param in function.parameters.data:
+        local_slots[param.string] = len(local_slots)
+    n_params = len(local_slots)
+    entry = len(code)
+    labels = {} # block label -> pc
+    fixups = [] # (position in code, block label) for jumps to blocks not yet placed
+    for block in function.body:
+        labels[block.label] = len(code)
+        for instr in block.instructions:
+            op = opcodes.get(type(instr))
+            if op is None:
+                raise RuntimeError(f'Unknown instruction type {instr} found during assembly')
+            a = b = 0
+            match instr:
+                case PUSH(value) | FPUSH(value):
+                    a = value
+                case LOAD_GLOBAL(name) | FLOAD_GLOBAL(name) | STORE_GLOBAL(name) | FSTORE_GLOBAL(name):
+                    if name not in module.global_slots:
+                        raise RuntimeError(f'Unknown global {name} in {function.name}')
+                    a = module.global_slots[name]
+                case LOCAL(name) | FLOCAL(name):
+                    a = local_slots.setdefault(name, len(local_slots))
+                case LOAD_LOCAL(name) | FLOAD_LOCAL(name) | STORE_LOCAL(name) | FSTORE_LOCAL(name):
+                    if name not in local_slots:
+                        raise RuntimeError(f'Unknown local {name} in {function.name}')
+                    a = local_slots[name]
+                case CALL(name, _, args):
+                    if name not in module.function_index:
+                        raise RuntimeError(f'Unknown function {name} called in {function.name}')
+                    a = module.function_index[name]
+                    b = len(args)
+                case GOTO(destination):
+                    fixups.append((len(code) + 1, destination.label))
+                case CBRANCH(true_block, false_block):
+                    fixups.append((len(code) + 1, true_block.label))
+                    fixups.append((len(code) + 2, false_block.label))
+            code += [op, a, b]
+    for position, label in fixups:
+        code[position] = labels[label]
+    return Function(function.name.string, entry, n_params, len(local_slots))
+
+def wrap(n : int) -> int: # Integer arithmetic is 32-bit, as in the LLVM output
+    return ((n + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+class VM:
+    def __init__(self, module : Module, out = sys.stdout):
+        self.module = module
+        self.write = out.write
+        self.globals = [0] * len(module.global_slots)
+        self.locals = []
+        self.stack = []
+        self.frames = [] # (return pc, caller locals)
+        self.handlers = [
+            self.push, self.push, self.pop,
+            self.add, self.minus, self.mult, self.divide, self.shl, self.neg,
+            self.fadd, self.fminus, self.fmult, self.fdivide, self.fneg,
+            self.lt, self.le, self.gt, self.ge, self.eq, self.ne,
+            self.lt, self.le, self.gt, self.ge, self.eq, self.ne,
+            self.load_global, self.load_global, self.load_local, self.load_local,
+            self.store_global, self.store_global, self.store_local, self.store_local,
+            self.local, self.flocal,
+            self.print, self.fprint, self.cprint,
+            self.call, self.ret, self.ret,
+            self.goto, self.cbranch
+        ]
+        assert len(self.handlers) == len(opcodes)
+
+    def run(self, name : str = 'main'):
+        function = self.module.functions[self.module.function_index[name]]
+        self.locals = [0] * function.n_locals
+        self.stack = []
+        self.frames = []
+        code = self.module.code
+        handlers = self.handlers
+        pc = function.entry
+        while pc >= 0:
+            pc = handlers[code[pc]](code[pc + 1], code[pc + 2], pc + WIDTH)
+        return self.stack.pop()
+
+    # Stack
+    def push(self, a, b, pc):
+        self.stack.append(a)
+        return pc
+
+    def pop(self, a, b, pc):
+        self.stack.pop()
+        return pc
+
+    # Arithmetic
+    def add(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = wrap(stack[-1] + right)
+        return pc
+
+    def minus(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = wrap(stack[-1] - right)
+        return pc
+
+    def mult(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = wrap(stack[-1] * right)
+        return pc
+
+    def divide(self, a, b, pc): # sdiv truncates towards zero, unlike //
+        stack = self.stack
+        right = stack.pop()
+        left = stack[-1]
+        if right == 0:
+            raise RuntimeError('Integer division by zero')
+        quotient = abs(left) // abs(right)
+        stack[-1] = wrap(quotient if (left < 0) == (right < 0) else -quotient)
+        return pc
+
+    def shl(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = wrap(stack[-1] << right)
+        return pc
+
+    def neg(self, a, b, pc):
+        self.stack[-1] = wrap(-self.stack[-1])
+        return pc
+
+    def fadd(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] += right
+        return pc
+
+    def fminus(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] -= right
+        return pc
+
+    def fneg(self, a, b, pc):
+        self.stack[-1] = -self.stack[-1]
+        return pc
+
+    def fmult(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] *= right
+        return pc
+
+    def fdivide(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        if right == 0.0:
+            raise RuntimeError('Float division by zero')
+        stack[-1] /= right
+        return pc
+
+    # Relations (shared by int and float)
+    def lt(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] < right else 0
+        return pc
+
+    def le(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] <= right else 0
+        return pc
+
+    def gt(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] > right else 0
+        return pc
+
+    def ge(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] >= right else 0
+        return pc
+
+    def eq(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] == right else 0
+        return pc
+
+    def ne(self, a, b, pc):
+        stack = self.stack
+        right = stack.pop()
+        stack[-1] = 1 if stack[-1] != right else 0
+        return pc
+
+    # Memory
+    def load_global(self, a, b, pc):
+        self.stack.append(self.globals[a])
+        return pc
+
+    def load_local(self, a, b, pc):
+        self.stack.append(self.locals[a])
+        return pc
+
+    def store_global(self, a, b, pc):
+        self.globals[a] = self.stack.pop()
+        return pc
+
+    def store_local(self, a, b, pc):
+        self.locals[a] = self.stack.pop()
+        return pc
+
+    def local(self, a, b, pc):
+        self.locals[a] = 0
+        return pc
+
+    def flocal(self, a, b, pc):
+        self.locals[a] = 0.0
+        return pc
+
+    # Output, formatted the same way as runtime.c
+    def print(self, a, b, pc):
+        self.write(f'Output: {self.stack.pop()}\n')
+        return pc
+
+    def fprint(self, a, b, pc):
+        self.write(f'Output: {self.stack.pop():f}\n')
+        return pc
+
+    def cprint(self, a, b, pc):
+        self.write(chr(self.stack.pop()))
+        return pc
+
+    # Control flow
+    def call(self, a, b, pc):
+        function = self.module.functions[a]
+        stack = self.stack
+        new_locals = stack[len(stack) - b:]
+        del stack[len(stack) - b:]
+        new_locals += [0] * (function.n_locals - b)
+        self.frames.append((pc, self.locals))
+        self.locals = new_locals
+        return function.entry
+
+    def ret(self, a, b, pc): # The return value stays on top of the stack for the caller
+        if not self.frames:
+            return -1
+        pc, self.locals = self.frames.pop()
+        return pc
+
+    def goto(self, a, b, pc):
+        return a
+
+    def cbranch(self, a, b, pc):
+        return a if self.stack.pop() else b
+
+def run_program(program : Program, out = sys.stdout) -> int:
+    return VM(assemble(program), out).run()
+
+def main():
+    from main import file_to_AST, lower_program
+    program = lower_program(file_to_AST(sys.argv[1]))
+    sys.exit(run_program(program))
+
+if __name__ == '__main__':
+    main()